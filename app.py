@@ -2,41 +2,102 @@
 Flask RAG Application with User Authentication
 """
 import os
+import time
+import hashlib
+import mimetypes
 import uuid
-import shutil
+import sqlite3
+import threading
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Optional, Tuple
 
 import openai
 try:
     import google.generativeai as genai
 except Exception:
     genai = None
-import fitz  # PyMuPDF
-import docx
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort
+from flask import Flask, Request, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, Response, g, stream_with_context
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from functools import wraps
 from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from dotenv import load_dotenv
 
-from models import db, User, Document
+from models import db, User, Document, UserStat
+import stats
+from embeddings import load_embedding_model, split_model_id
+from index_store import UserIndexStore, IndexWriter, coarse_search
+import metrics
+from profiling import RequestProfiler
+from uploads import SpooledUpload
+from extraction import extract_docx_text, extract_pdf_pages, strip_repeated_lines
+from dedup import LSHCache, minhash, find_duplicates, unlink_document
+from search_cache import SearchResultCache, normalize_query
+from local_llm import LocalLLM
 
 # Load environment variables
 load_dotenv()
 
+class UploadRequest(Request):
+    """Request that lets the upload route take large files, spooled straight into the upload folder.
+    
+    Every other endpoint, including the unauthenticated ones, keeps the
+    MAX_CONTENT_LENGTH limit and Werkzeug's default file handling.
+    """
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'upload_file':
+            return UPLOAD_MAX_BYTES + 1024 * 1024  # room for the multipart envelope
+        return super().max_content_length
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != 'upload_file':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return SpooledUpload(app.config['UPLOAD_FOLDER'], UPLOAD_MAX_BYTES)
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite3'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///db.sqlite3')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'uploads')
 app.config['FAISS_FOLDER'] = os.path.join(BASE_DIR, 'faiss_indexes')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['PROFILE_FOLDER'] = os.path.join(BASE_DIR, 'profiles')
+# Uploads are streamed to disk, so the limit does not affect worker memory.
+# It applies to the upload route only (see UploadRequest); every other
+# request body is capped at 16 MB.
+UPLOAD_MAX_MB = int(os.getenv('UPLOAD_MAX_MB', '200'))
+UPLOAD_MAX_BYTES = UPLOAD_MAX_MB * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+
+# Let the front-end server stream downloads instead of the Python worker:
+# 'x-sendfile' (Apache mod_xsendfile, lighttpd) or 'x-accel' (nginx, with an
+# internal location at DOWNLOAD_ACCEL_PREFIX aliased to the upload folder)
+DOWNLOAD_OFFLOAD = os.getenv('DOWNLOAD_OFFLOAD', '').lower().strip()
+DOWNLOAD_ACCEL_PREFIX = os.getenv('DOWNLOAD_ACCEL_PREFIX', '/protected-uploads/')
+
+# PDFs with at least this many pages are extracted by a process pool of
+# PDF_EXTRACT_WORKERS (default: the cores split between the GUNICORN_WORKERS
+# server processes, so all pools together stay within the CPU count);
+# 0 disables parallel extraction
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '100'))
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', '0')) or \
+    max(1, (os.cpu_count() or 1) // int(os.getenv('GUNICORN_WORKERS', '1')))
+
+# Lines at the top or bottom of at least this share of a PDF's pages are
+# stripped as repeated headers and footers before chunking; 0 disables
+BOILERPLATE_MIN_SHARE = float(os.getenv('BOILERPLATE_MIN_SHARE', '0.5'))
+
+# Chunks whose estimated Jaccard similarity (MinHash) with an indexed chunk
+# reaches this threshold are linked to it instead of being embedded; 0 disables
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.9'))
 
 # Initialize extensions
 db.init_app(app)
@@ -46,10 +107,39 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 
+# SQLite tuning, applied to every new connection. WAL lets readers proceed
+# while an upload is writing, and synchronous=NORMAL is durable in WAL mode
+# except for the last transactions on power loss.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()  # OFF, NORMAL, FULL
+SQLITE_CACHE_SIZE_MB = int(os.getenv('SQLITE_CACHE_SIZE_MB', '64'))
+SQLITE_MMAP_SIZE_MB = int(os.getenv('SQLITE_MMAP_SIZE_MB', '256'))
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enable WAL and tuned pragmas on new SQLite connections."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    if SQLITE_SYNCHRONOUS in ('OFF', 'NORMAL', 'FULL'):
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_MB * 1024}")  # negative = KiB
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 # LLM provider configuration
-LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'openai').lower().strip()  # 'openai' (default) or 'gemini'
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'openai').lower().strip()  # 'openai' (default), 'gemini' or 'local'
 print(f"[STARTUP] LLM_PROVIDER: {LLM_PROVIDER}")
 
+# The 'local' provider answers extractively from the context without network
+# access, after LOCAL_LLM_LATENCY_MS and with LOCAL_LLM_TOKEN_MS between
+# streamed tokens, for load tests and air-gapped installs
+local_llm = LocalLLM(latency_ms=float(os.getenv('LOCAL_LLM_LATENCY_MS', '0')),
+                     token_ms=float(os.getenv('LOCAL_LLM_TOKEN_MS', '0')))
+
 # Initialize OpenAI or Gemini
 openai.api_key = os.getenv('OPENAI_API_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
@@ -65,8 +155,118 @@ if LLM_PROVIDER == 'gemini' and genai is not None and GEMINI_API_KEY:
 elif LLM_PROVIDER == 'gemini':
     print(f"[STARTUP] Warning: Gemini selected but not properly configured")
 
-# Initialize sentence transformer model
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+# Embedding backend configuration
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'sentence-transformers').lower().strip()  # or 'onnx'
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', os.path.join(BASE_DIR, 'onnx_models', EMBEDDING_MODEL_NAME))
+ONNX_QUANTIZED = os.getenv('ONNX_QUANTIZED', 'true').lower() in ('1', 'true', 'yes')
+print(f"[STARTUP] EMBEDDING_BACKEND: {EMBEDDING_BACKEND}")
+
+# Initialize embedding model
+embedding_model = load_embedding_model(
+    EMBEDDING_BACKEND,
+    model_name=EMBEDDING_MODEL_NAME,
+    onnx_model_dir=ONNX_MODEL_DIR,
+    onnx_quantized=ONNX_QUANTIZED
+)
+
+# Search mode: 'exact' searches the float32 index held in memory; 'two_stage'
+# keeps only a compressed coarse index (sq8 or binary) in memory and re-scores
+# its TWO_STAGE_CANDIDATES best candidates with exact memory-mapped vectors
+SEARCH_MODE = os.getenv('SEARCH_MODE', 'exact').lower().strip()
+TWO_STAGE_COARSE = os.getenv('TWO_STAGE_COARSE', 'sq8').lower().strip()
+TWO_STAGE_CANDIDATES = int(os.getenv('TWO_STAGE_CANDIDATES', '200'))
+print(f"[STARTUP] SEARCH_MODE: {SEARCH_MODE}")
+
+# Maximal marginal relevance: fetch MMR_CANDIDATES hits per query and pick k
+# of them that are relevant but not near-copies of each other. MMR_LAMBDA
+# weighs relevance (1.0) against diversity (0.0)
+SEARCH_MMR = os.getenv('SEARCH_MMR', 'false').lower() in ('1', 'true', 'yes')
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.5'))
+MMR_CANDIDATES = int(os.getenv('MMR_CANDIDATES', '20'))
+
+# Score-aware retrieval for answers: of the SEARCH_MAX_K best chunks, keep
+# those scoring at least SEARCH_MIN_SCORE (cosine; -1 disables) and
+# SEARCH_RELATIVE_SCORE times the best score (0 disables), cut at the largest
+# drop between consecutive scores if it reaches SEARCH_SCORE_GAP (0 disables).
+# When no chunk is left the LLM is not called.
+SEARCH_MAX_K = int(os.getenv('SEARCH_MAX_K', '5'))
+SEARCH_MIN_SCORE = float(os.getenv('SEARCH_MIN_SCORE', '0.2'))
+SEARCH_RELATIVE_SCORE = float(os.getenv('SEARCH_RELATIVE_SCORE', '0.6'))
+SEARCH_SCORE_GAP = float(os.getenv('SEARCH_SCORE_GAP', '0.15'))
+
+# Indexes of at least this size are memory-mapped for searching instead of
+# copied onto each worker's heap (negative disables memory mapping)
+INDEX_MMAP_MIN_MB = float(os.getenv('INDEX_MMAP_MIN_MB', '16'))
+
+# Users whose index and metadata each worker keeps in memory between requests,
+# least recently used evicted first
+INDEX_CACHE_USERS = int(os.getenv('INDEX_CACHE_USERS', '64'))
+
+# Models of indexes not yet migrated to the configured one, loaded on demand
+_embedding_models = {embedding_model.model_id: embedding_model}
+_embedding_models_lock = threading.Lock()
+
+def get_embedding_model(model_id: str):
+    """The embedding model with this id; the configured one unless an index still uses another."""
+    model = _embedding_models.get(model_id)
+    if model is not None:
+        return model
+    with _embedding_models_lock:
+        if model_id not in _embedding_models:
+            app.logger.info('Loading embedding model %s for unmigrated indexes', model_id)
+            # Indexes embedded by the int8 ONNX graph need that graph whatever
+            # the configured backend; other ids load with the configured one
+            model_name, int8 = split_model_id(model_id)
+            _embedding_models[model_id] = load_embedding_model(
+                'onnx' if int8 else EMBEDDING_BACKEND,
+                model_name=model_name,
+                onnx_model_dir=os.path.join(BASE_DIR, 'onnx_models', model_name),
+                onnx_quantized=int8
+            )
+        return _embedding_models[model_id]
+
+# Per-user FAISS indexes, cached per process and guarded by file locks.
+# Each index is tagged with the model that embedded it; new indexes use the
+# configured model and migrate_embeddings.py re-embeds older ones.
+index_store = UserIndexStore(app.config['FAISS_FOLDER'],
+                             dimension=embedding_model.dimension,
+                             model_id=embedding_model.model_id,
+                             coarse_type=TWO_STAGE_COARSE if SEARCH_MODE == 'two_stage' else None,
+                             mmap_min_bytes=int(INDEX_MMAP_MIN_MB * 1024 * 1024) if INDEX_MMAP_MIN_MB >= 0 else None,
+                             max_cached_users=INDEX_CACHE_USERS)
+# Single writer per user: concurrent additions/removals are group-committed
+index_writer = IndexWriter(index_store)
+# Per-user near-duplicate lookup, rebuilt when the index changes
+lsh_cache = LSHCache(max_users=INDEX_CACHE_USERS)
+
+# Final search results (with highlighting) per user, valid until the user's
+# index version changes; 0 disables
+RESULT_CACHE_ENTRIES = int(os.getenv('RESULT_CACHE_ENTRIES', '1024'))
+result_cache = SearchResultCache(RESULT_CACHE_ENTRIES)
+
+# Metrics exposed on /metrics (set METRICS_TOKEN to require a bearer token)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+metrics.register_gauge('askmydocs_index_cache_entries', 'User indexes cached in the worker processes.',
+                       lambda: index_store.cache_stats()[0])
+metrics.register_gauge('askmydocs_index_cache_vectors', 'Vectors held by the cached user indexes.',
+                       lambda: index_store.cache_stats()[1])
+metrics.register_gauge('askmydocs_result_cache_entries', 'Search results cached in the worker processes.',
+                       lambda: len(result_cache))
+
+# Limits of the batch search API
+BATCH_SEARCH_MAX_QUERIES = int(os.getenv('BATCH_SEARCH_MAX_QUERIES', '500'))
+BATCH_SEARCH_MAX_K = 50
+
+# Page sizes for keyset-paginated listings
+DOCUMENTS_PER_PAGE = 25
+ADMIN_USERS_PER_PAGE = 50
+
+# Admin dashboard counters are fully recomputed at most this often (seconds)
+STATS_RECONCILE_INTERVAL = int(os.getenv('STATS_RECONCILE_INTERVAL', '3600'))
+
+# Opt-in request profiling, configured from /admin/profiling
+request_profiler = RequestProfiler(app.config['PROFILE_FOLDER'])
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx'}
@@ -116,115 +316,238 @@ def allowed_file(filename):
     """Check if file extension is allowed."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def file_sha256(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Hex SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """Encode a (timestamp, id) keyset position for use in a URL."""
+    return f"{timestamp.isoformat()}_{row_id}"
+
+def decode_cursor(cursor: str):
+    """Decode a cursor from encode_cursor; returns None if it is malformed."""
+    try:
+        timestamp, row_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+def keyset_page(query, time_column, id_column, after: str = None, per_page: int = 25, key=None):
+    """Fetch one page of ``query`` ordered newest first, seeking past ``after``.
+
+    Unlike OFFSET pagination, the database jumps straight to the cursor
+    position through the (time, id) ordering, so deep pages cost the same as
+    the first one. ``key`` maps a result row to its (timestamp, id).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    position = decode_cursor(after) if after else None
+    if position:
+        query = query.filter(db.tuple_(time_column, id_column) < db.tuple_(*position))
+    rows = query.order_by(time_column.desc(), id_column.desc()).limit(per_page + 1).all()
+    
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(*(key(rows[-1]) if key else (rows[-1].uploaded_at, rows[-1].id)))
+    return rows, next_cursor
+
 def create_directories():
     """Create necessary directories if they don't exist."""
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['FAISS_FOLDER'], exist_ok=True)
 
-def extract_text_from_file(file_path: str, file_type: str) -> str:
-    """Extract text from uploaded files."""
+@metrics.timed('extraction')
+def extract_pages_from_file(file_path: str, file_type: str) -> List[Tuple[Optional[int], str]]:
+    """Extract text from uploaded files as ``(page_number, text)`` pairs.
+
+    PDFs yield one pair per page; other formats have no pages and yield a
+    single pair with page number None.
+    """
     try:
         if file_type == 'txt':
             with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+                return [(None, f.read())]
         
         elif file_type == 'pdf':
-            doc = fitz.open(file_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            return text
+            return extract_pdf_pages(file_path, parallel_min_pages=PDF_PARALLEL_MIN_PAGES,
+                                     workers=PDF_EXTRACT_WORKERS)
         
         elif file_type == 'docx':
-            doc = docx.Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+            return [(None, extract_docx_text(file_path))]
         
-        return ""
+        return []
     except Exception as e:
         print(f"Error extracting text from {file_path}: {str(e)}")
-        return ""
+        return []
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 100) -> List[str]:
-    """Split text into overlapping chunks."""
-    words = text.split()
-    chunks = []
+def extract_text_from_file(file_path: str, file_type: str) -> str:
+    """Extract text from uploaded files."""
+    return ''.join(text for _, text in extract_pages_from_file(file_path, file_type))
+
+@metrics.timed('chunking')
+def chunk_pages(pages: List[Tuple[Optional[int], str]], chunk_size: int = 500,
+                overlap: int = 100) -> Tuple[List[str], List[Tuple[Optional[int], Optional[int]]]]:
+    """Split page texts into overlapping chunks.
     
+    Returns the chunks and, for each chunk, the (first, last) page it spans.
+    """
+    words = []
+    word_pages = []
+    for page_number, text in pages:
+        page_words = text.split()
+        words.extend(page_words)
+        word_pages.extend([page_number] * len(page_words))
+    
+    chunks = []
+    page_spans = []
     for i in range(0, len(words), chunk_size - overlap):
-        chunk = ' '.join(words[i:i + chunk_size])
-        if chunk.strip():
-            chunks.append(chunk.strip())
+        end = min(i + chunk_size, len(words))
+        chunks.append(' '.join(words[i:end]))
+        page_spans.append((word_pages[i], word_pages[end - 1]))
         
         if i + chunk_size >= len(words):
             break
     
-    return chunks
+    return chunks, page_spans
+
+def chunk_text(text: str, chunk_size: int = 500, overlap: int = 100) -> List[str]:
+    """Split text into overlapping chunks."""
+    return chunk_pages([(None, text)], chunk_size, overlap)[0]
+
+def count_chunks(pages: List[Tuple[Optional[int], str]], chunk_size: int = 500, overlap: int = 100) -> int:
+    """Number of chunks ``chunk_pages`` would produce, without building them."""
+    word_count = sum(len(text.split()) for _, text in pages)
+    if word_count == 0:
+        return 0
+    return 1 + -(-max(0, word_count - chunk_size) // (chunk_size - overlap))
+
+def remove_boilerplate(pages: List[Tuple[Optional[int], str]]) -> Tuple[List[Tuple[Optional[int], str]], int]:
+    """Strip repeated headers and footers from extracted pages.
+    
+    Returns the cleaned pages and the number of chunks this saves.
+    """
+    cleaned, removed_lines = strip_repeated_lines(pages, min_share=BOILERPLATE_MIN_SHARE)
+    if not removed_lines:
+        return pages, 0
+    chunks_saved = count_chunks(pages) - count_chunks(cleaned)
+    metrics.inc('boilerplate_lines_removed', removed_lines)
+    metrics.inc('boilerplate_chunks_saved', chunks_saved)
+    return cleaned, chunks_saved
 
 def get_user_faiss_path(user_id: int) -> str:
     """Get the FAISS index path for a user."""
-    user_dir = os.path.join(app.config['FAISS_FOLDER'], str(user_id))
-    os.makedirs(user_dir, exist_ok=True)
-    return os.path.join(user_dir, 'index.faiss')
+    return index_store.index_path(user_id)
 
 def get_user_metadata_path(user_id: int) -> str:
     """Get the metadata path for a user."""
-    user_dir = os.path.join(app.config['FAISS_FOLDER'], str(user_id))
-    os.makedirs(user_dir, exist_ok=True)
-    return os.path.join(user_dir, 'metadata.npy')
+    return index_store.metadata_path(user_id)
 
 def load_or_create_faiss_index(user_id: int):
-    """Load existing FAISS index or create a new one."""
-    faiss_path = get_user_faiss_path(user_id)
-    metadata_path = get_user_metadata_path(user_id)
-    
-    if os.path.exists(faiss_path) and os.path.exists(metadata_path):
-        index = faiss.read_index(faiss_path)
-        metadata = np.load(metadata_path, allow_pickle=True).tolist()
-        return index, metadata
-    else:
-        # Create new index (384 dimensions for all-MiniLM-L6-v2)
-        index = faiss.IndexFlatIP(384)
-        metadata = []
-        return index, metadata
+    """Load existing FAISS index or create a new one.
+
+    The result is cached per process and shared between requests, so callers
+    must not modify it. Writers use ``index_store.read`` under the user's lock.
+    """
+    return index_store.load(user_id)
+
+def count_indexed_chunks(user_id: int) -> int:
+    """Number of vectors in the user's index, from what the search mode keeps loaded."""
+    if SEARCH_MODE == 'two_stage':
+        coarse, _, _, _ = index_store.load_two_stage(user_id)
+        return coarse.ntotal if coarse is not None else 0
+    return load_or_create_faiss_index(user_id)[0].ntotal
 
 def save_faiss_index(user_id: int, index, metadata):
-    """Save FAISS index and metadata."""
-    faiss_path = get_user_faiss_path(user_id)
-    metadata_path = get_user_metadata_path(user_id)
-    
-    faiss.write_index(index, faiss_path)
-    np.save(metadata_path, metadata)
+    """Save FAISS index and metadata (caller holds the user's index lock)."""
+    return index_store.save(user_id, index, metadata)
 
-def add_document_to_faiss(user_id: int, document_id: int, chunks: List[str], filename: str):
-    """Add document chunks to user's FAISS index."""
-    index, metadata = load_or_create_faiss_index(user_id)
+def add_document_to_faiss(user_id: int, document_id: int, chunks: List[str], filename: str,
+                          page_spans: Optional[List[Tuple[Optional[int], Optional[int]]]] = None):
+    """Add document chunks to user's FAISS index.
     
-    # Generate embeddings for chunks
-    embeddings = embedding_model.encode(chunks)
+    ``page_spans`` gives the (first, last) page of each chunk, if known.
+    Near-duplicates of indexed chunks, or of earlier chunks of the same
+    document, are linked to them instead of being embedded (see ``dedup``).
+    Returns the number of chunks and how many of them were linked.
+    """
+    def embed(model_id, positions):
+        model = get_embedding_model(model_id)
+        if not positions:
+            return np.zeros((0, model.dimension), dtype='float32')
+        with metrics.timed('embed'):
+            embeddings = model.encode([chunks[i] for i in positions])
+        # Normalize embeddings for cosine similarity
+        faiss.normalize_L2(embeddings)
+        return embeddings
     
-    # Normalize embeddings for cosine similarity
-    faiss.normalize_L2(embeddings)
+    page_spans = page_spans or [(None, None)] * len(chunks)
+    new_metadata = [{
+        'document_id': document_id,
+        'chunk_index': i,
+        'text': chunk,
+        'filename': filename,
+        'page': first_page,
+        'page_end': last_page
+    } for i, (chunk, (first_page, last_page)) in enumerate(zip(chunks, page_spans))]
     
-    # Add to index
-    index.add(embeddings)
+    canonical = [None] * len(chunks)  # (document_id, chunk_index) of the chunk each one duplicates
+    if DEDUP_THRESHOLD > 0:
+        with metrics.timed('dedup'):
+            signatures = [minhash(chunk) for chunk in chunks]
+            for chunk_metadata, signature in zip(new_metadata, signatures):
+                chunk_metadata['minhash'] = signature.tobytes()
+            indexed_metadata = index_store.load_metadata(user_id)
+            canonical = find_duplicates(document_id, signatures,
+                                        lsh_cache.get(user_id, indexed_metadata), DEDUP_THRESHOLD)
+    unique = [i for i, key in enumerate(canonical) if key is None]
     
-    # Add metadata
-    for i, chunk in enumerate(chunks):
-        metadata.append({
-            'document_id': document_id,
-            'chunk_index': i,
-            'text': chunk,
-            'filename': filename
-        })
+    # Embed with the model of the user's index so it never mixes models
+    model_id = index_store.read_model_tag(user_id)[0]
+    embeddings = embed(model_id, unique)
     
-    # Save updated index
-    save_faiss_index(user_id, index, metadata)
+    def append_chunks(index, metadata):
+        positions = {(chunk['document_id'], chunk['chunk_index']): position
+                     for position, chunk in enumerate(metadata)}
+        added = list(unique)
+        links = []
+        for i, key in enumerate(canonical):
+            if key is None:
+                continue
+            if key[0] == document_id or key in positions:
+                links.append((i, key))
+            else:
+                added.append(i)  # its canonical chunk was deleted meanwhile
+        
+        vectors = embeddings
+        current_model_id = index_store.read_model_tag(user_id)[0]
+        if current_model_id != model_id or len(added) != len(unique):
+            added.sort()
+            vectors = embed(current_model_id, added)  # the index was migrated meanwhile
+        if len(vectors):
+            index.add(vectors)
+        positions.update({(document_id, i): len(metadata) + n for n, i in enumerate(added)})
+        metadata.extend(new_metadata[i] for i in added)
+        
+        for i, key in links:
+            position = positions[key]
+            duplicate = {name: value for name, value in new_metadata[i].items() if name != 'minhash'}
+            metadata[position] = dict(metadata[position],
+                                      duplicates=metadata[position].get('duplicates', []) + [duplicate])
+        return index, metadata
     
-    return len(chunks)
+    # Queued with any other pending writes for this user and saved once
+    index_writer.submit(user_id, append_chunks)
+    
+    linked = len(chunks) - len(unique)
+    if linked:
+        metrics.inc('duplicate_chunks_linked', linked)
+    return len(chunks), linked
 
+@metrics.timed('highlight')
 def highlight_relevant_content(text: str, query: str) -> str:
     """Highlight content most relevant to the query using semantic similarity."""
     import re
@@ -295,49 +618,214 @@ def highlight_keywords(text: str, query: str) -> str:
     
     return re.sub(pattern, replace_match, text, flags=re.IGNORECASE)
 
-def search_faiss_index(user_id: int, query: str, k: int = 5, document_id: int = None):
-    """Search FAISS index for relevant chunks."""
+def select_relevant(results: List[Dict]) -> List[Dict]:
+    """Keep the results that clear the score cutoffs, in their original order.
+    
+    The number kept adapts to the score distribution: chunks must reach
+    SEARCH_MIN_SCORE and SEARCH_RELATIVE_SCORE times the best score, and the
+    ranking is cut at its largest score drop when that reaches SEARCH_SCORE_GAP.
+    """
+    if not results:
+        return results
+    best = max(result['score'] for result in results)
+    threshold = SEARCH_MIN_SCORE
+    if best > 0:
+        threshold = max(threshold, best * SEARCH_RELATIVE_SCORE)
+    scores = sorted((result['score'] for result in results if result['score'] >= threshold), reverse=True)
+    if SEARCH_SCORE_GAP > 0 and len(scores) > 1:
+        drops = [higher - lower for higher, lower in zip(scores, scores[1:])]
+        largest = max(range(len(drops)), key=drops.__getitem__)
+        if drops[largest] >= SEARCH_SCORE_GAP:
+            threshold = max(threshold, scores[largest])
+    return [result for result in results if result['score'] >= threshold]
+
+def search_faiss_index(user_id: int, query: str, k: int = 5, document_id: int = None,
+                       highlight: bool = True, mode: str = None, mmr: bool = None,
+                       adaptive: bool = False):
+    """Search FAISS index for relevant chunks.
+    
+    With ``adaptive``, ``k`` is an upper bound and only the chunks passing
+    ``select_relevant`` are returned (possibly none).
+    
+    Results are cached per user until the index version changes, so a
+    repeated query skips embedding, searching and highlighting.
+    """
+    mode = mode or SEARCH_MODE
+    mmr = SEARCH_MMR if mmr is None else mmr
+    cache_key = (normalize_query(query), document_id, k, mode, mmr, adaptive, highlight)
+    version = index_store.version(user_id)
+    cached = result_cache.get(user_id, version, cache_key)
+    if cached is not None:
+        metrics.inc('result_cache_hit')
+        return cached
+    metrics.inc('result_cache_miss')
+    
     try:
-        index, metadata = load_or_create_faiss_index(user_id)
-        
-        if index.ntotal == 0:
-            return []
-        
-        # Generate query embedding
-        query_embedding = embedding_model.encode([query])
-        faiss.normalize_L2(query_embedding)
-        
-        # Search
-        scores, indices = index.search(query_embedding, min(k, index.ntotal))
-        
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(metadata):
-                chunk_metadata = metadata[idx]
-                
-                # Filter by document if specified
-                if document_id and chunk_metadata['document_id'] != document_id:
-                    continue
-                
-                # Highlight semantically relevant content
-                highlighted_text = highlight_relevant_content(chunk_metadata['text'], query)
-                
-                results.append({
-                    'text': chunk_metadata['text'],  # Original text for LLM
-                    'highlighted_text': highlighted_text,  # Highlighted text for display
-                    'filename': chunk_metadata['filename'],
-                    'document_id': chunk_metadata['document_id'],
-                    'score': float(score)
-                })
-        
+        results = search_faiss_index_batch(user_id, [query], k=k, document_ids=[document_id],
+                                           mode=mode, mmr=mmr)[0]
+        if adaptive:
+            results = select_relevant(results)
+        for result in results:
+            # Highlight semantically relevant content
+            result['highlighted_text'] = highlight_relevant_content(result['text'], query) if highlight else None
+        result_cache.put(user_id, version, cache_key, results)
         return results
     except Exception as e:
         print(f"Error searching FAISS index: {str(e)}")
         return []
 
+def mmr_select(vectors: np.ndarray, scores: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """Pick ``k`` candidates by maximal marginal relevance.
+    
+    ``vectors`` are the normalized candidate vectors and ``scores`` their
+    similarity to the query. Each step takes the candidate with the best
+    ``lambda_mult * score - (1 - lambda_mult) * (similarity to the closest
+    candidate already picked)``. Returns candidate positions in pick order.
+    """
+    similarity = vectors @ vectors.T
+    first = int(np.argmax(scores))
+    selected = [first]
+    redundancy = similarity[first].copy()
+    available = np.ones(len(scores), dtype=bool)
+    available[first] = False
+    while len(selected) < min(k, len(scores)):
+        marginal = lambda_mult * scores - (1 - lambda_mult) * redundancy
+        marginal[~available] = -np.inf
+        best = int(np.argmax(marginal))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+def search_faiss_index_batch(user_id: int, queries: List[str], k: int = 5,
+                             document_ids: List[int] = None, mode: str = None,
+                             candidates: int = None, mmr: bool = None) -> List[List[Dict]]:
+    """Search many queries against a user's index at once.
+    
+    All queries are encoded in one batch. Queries without a document filter
+    are answered by a single search over the query matrix; queries
+    restricted to a document are scored exactly against that document's
+    vectors (one matrix product per document), so a filter never loses hits
+    that a global top-k would have cut off. Returns one ranked result list
+    per query (without highlighting).
+    
+    ``mode`` defaults to SEARCH_MODE. In 'two_stage' mode the unfiltered
+    search runs on the coarse index, and its ``candidates`` best hits per
+    query (default TWO_STAGE_CANDIDATES) are re-scored with exact vectors.
+    
+    With ``mmr`` (default SEARCH_MMR) the MMR_CANDIDATES best hits are
+    fetched and k of them are picked by maximal marginal relevance, using
+    the candidates' vectors from the index.
+    """
+    mode = mode or SEARCH_MODE
+    mmr = SEARCH_MMR if mmr is None else mmr
+    fetch = max(k, MMR_CANDIDATES) if mmr else k
+    document_ids = document_ids or [None] * len(queries)
+    results = [[] for _ in queries]
+    
+    if mode == 'two_stage':
+        coarse, vectors, metadata, model_tag = index_store.load_two_stage(user_id)
+        ntotal = coarse.ntotal if coarse is not None else 0
+        get_vectors = lambda positions: np.asarray(vectors[positions])
+    elif mode == 'exact':
+        index, metadata, model_tag = index_store.load_tagged(user_id)
+        ntotal = index.ntotal
+        get_vectors = index.reconstruct_batch
+    else:
+        raise ValueError(f"Unknown search mode: {mode!r} (expected 'exact' or 'two_stage')")
+    if ntotal == 0 or not queries:
+        return results
+    
+    # Queries are embedded with the model of the index, which until the
+    # user's migration completes may be an older one
+    with metrics.timed('embed'):
+        query_embeddings = get_embedding_model(model_tag[0]).encode(list(queries))
+    faiss.normalize_L2(query_embeddings)
+    
+    def to_result(position, score, document_id=None):
+        chunk_metadata = metadata[position]
+        if document_id and chunk_metadata['document_id'] != document_id:
+            # A near-duplicate of this document linked to another document's chunk
+            chunk_metadata = next(duplicate for duplicate in chunk_metadata['duplicates']
+                                  if duplicate['document_id'] == document_id)
+        return {
+            'text': chunk_metadata['text'],  # Original text for LLM
+            'highlighted_text': None,
+            'filename': chunk_metadata['filename'],
+            'document_id': chunk_metadata['document_id'],
+            'chunk_index': chunk_metadata['chunk_index'],
+            'page': chunk_metadata.get('page'),  # None for older chunks and non-PDF files
+            'score': float(score)
+        }
+    
+    def finish(row, positions, scores, document_id=None, vectors=None):
+        """Store the result list of a query from its ranked hits, diversified with MMR."""
+        if mmr and len(positions) > k:
+            with metrics.timed('mmr'):
+                if vectors is None:
+                    vectors = get_vectors(np.asarray(positions, dtype='int64'))
+                picked = mmr_select(vectors, np.asarray(scores), k, MMR_LAMBDA)
+            positions = [positions[i] for i in picked]
+            scores = [scores[i] for i in picked]
+        results[row] = [to_result(position, score, document_id)
+                        for position, score in zip(positions, scores)]
+    
+    def rank_exact(rows, positions, document_id=None):
+        """Score ``positions`` exactly for each query row and keep the top ``fetch``."""
+        positions = np.sort(np.asarray(positions, dtype='int64'))  # sequential reads from the memory map
+        vectors = get_vectors(positions)
+        scores = query_embeddings[rows] @ vectors.T
+        top = min(fetch, len(positions))
+        for row, row_scores in zip(rows, scores):
+            best = np.argpartition(-row_scores, top - 1)[:top]
+            best = best[np.argsort(-row_scores[best])]
+            finish(row, positions[best], row_scores[best], document_id, vectors[best])
+    
+    unfiltered = [row for row, document_id in enumerate(document_ids) if not document_id]
+    if unfiltered and mode == 'two_stage':
+        pool = min(max(candidates or TWO_STAGE_CANDIDATES, fetch), ntotal)
+        with metrics.timed('faiss_search'):
+            candidate_positions = coarse_search(coarse, query_embeddings[unfiltered], pool)
+        with metrics.timed('rerank'):
+            for row, row_candidates in zip(unfiltered, candidate_positions):
+                row_candidates = row_candidates[row_candidates >= 0]
+                if len(row_candidates):
+                    rank_exact([row], row_candidates)
+    elif unfiltered:
+        with metrics.timed('faiss_search'):
+            scores, indices = index.search(query_embeddings[unfiltered], min(fetch, ntotal))
+        for row, row_scores, row_indices in zip(unfiltered, scores, indices):
+            valid = (row_indices >= 0) & (row_indices < len(metadata))
+            finish(row, row_indices[valid], row_scores[valid])
+    
+    filtered = {}
+    for row, document_id in enumerate(document_ids):
+        if document_id:
+            filtered.setdefault(document_id, []).append(row)
+    if filtered:
+        positions_by_document = {}
+        for position, chunk_metadata in enumerate(metadata):
+            # Linked near-duplicates are searched through their canonical chunk
+            owners = {chunk_metadata['document_id']}
+            owners.update(duplicate['document_id'] for duplicate in chunk_metadata.get('duplicates', ()))
+            for document_id in owners & filtered.keys():
+                positions_by_document.setdefault(document_id, []).append(position)
+        with metrics.timed('faiss_search'):
+            for document_id, rows in filtered.items():
+                if positions_by_document.get(document_id):
+                    rank_exact(rows, positions_by_document[document_id], document_id)
+    
+    return results
+
+@metrics.timed('prompt_build')
 def _build_context_and_prompt(query: str, context_chunks: List[Dict]) -> str:
+    def source(chunk):
+        if chunk.get('page'):
+            return f"{chunk['filename']} (page {chunk['page']})"
+        return chunk['filename']
+    
     context = "\n\n".join([
-        f"From {chunk['filename']}:\n{chunk['text']}"
+        f"From {source(chunk)}:\n{chunk['text']}"
         for chunk in context_chunks
     ])
     prompt = (
@@ -468,51 +956,90 @@ def choose_gemini_model(candidates_only: bool = False):
     ]
     return fallback_list if candidates_only else fallback_list[0]
 
+def generate_rag_response_local(query: str, context_chunks: List[Dict]) -> str:
+    if not context_chunks:
+        return "I couldn't find any relevant information in your documents to answer this question."
+    _build_context_and_prompt(query, context_chunks)  # same prompt cost as a hosted model
+    return local_llm.generate(query, context_chunks)
+
+@metrics.timed('llm_call')
 def generate_rag_response(query: str, context_chunks: List[Dict]) -> str:
     """Generate response using the selected LLM provider."""
-    print(f"[RAG] Using LLM provider: {LLM_PROVIDER}")
+    app.logger.debug('Generating RAG response with LLM provider: %s', LLM_PROVIDER)
     if LLM_PROVIDER == 'gemini':
-        print(f"[RAG] Calling Gemini API")
         return generate_rag_response_gemini(query, context_chunks)
-    print(f"[RAG] Calling OpenAI API")
+    if LLM_PROVIDER == 'local':
+        return generate_rag_response_local(query, context_chunks)
     return generate_rag_response_openai(query, context_chunks)
 
+def stream_rag_response(query: str, context_chunks: List[Dict]):
+    """Yield the response in pieces as the provider produces them.
+    
+    The local provider streams token by token; the others yield their
+    whole answer at once.
+    """
+    if LLM_PROVIDER != 'local' or not context_chunks:
+        yield generate_rag_response(query, context_chunks)
+        return
+    
+    start = time.perf_counter()
+    _build_context_and_prompt(query, context_chunks)  # same prompt cost as a hosted model
+    try:
+        yield from local_llm.stream(query, context_chunks)
+    finally:
+        metrics.observe('llm_call', time.perf_counter() - start)
+
 def remove_document_from_faiss(user_id: int, document_id: int):
     """Remove document chunks from FAISS index."""
-    try:
-        index, metadata = load_or_create_faiss_index(user_id)
-        
-        # Find indices to remove
-        indices_to_remove = []
-        new_metadata = []
-        
-        for i, chunk_meta in enumerate(metadata):
-            if chunk_meta['document_id'] == document_id:
-                indices_to_remove.append(i)
-            else:
-                new_metadata.append(chunk_meta)
+    def drop_chunks(index, metadata):
+        # Chunks with near-duplicates in other documents are handed over to
+        # one of them instead of being removed
+        unlinked = unlink_document(metadata, document_id)
+        if unlinked is None:
+            return None
+        indices_to_remove, new_metadata = unlinked
         
+        # Flat indexes compact in place, keeping the remaining vectors in
+        # metadata order, so nothing needs to be re-embedded
         if indices_to_remove:
-            # Create new index without the removed chunks
-            if new_metadata:
-                # Get embeddings for remaining chunks
-                remaining_texts = [meta['text'] for meta in new_metadata]
-                embeddings = embedding_model.encode(remaining_texts)
-                faiss.normalize_L2(embeddings)
-                
-                # Create new index
-                new_index = faiss.IndexFlatIP(384)
-                new_index.add(embeddings)
-                
-                save_faiss_index(user_id, new_index, new_metadata)
-            else:
-                # No chunks left, create empty index
-                empty_index = faiss.IndexFlatIP(384)
-                save_faiss_index(user_id, empty_index, [])
+            index.remove_ids(np.array(indices_to_remove, dtype='int64'))
+        return index, new_metadata
     
+    try:
+        index_writer.submit(user_id, drop_chunks)
     except Exception as e:
         print(f"Error removing document from FAISS: {str(e)}")
 
+@app.before_request
+def start_request_profile():
+    """Start a cProfile run if this request is sampled for profiling."""
+    def get_user_id():
+        return current_user.id if current_user.is_authenticated else None
+
+    if request.endpoint not in ('static', 'metrics_endpoint') and \
+            request_profiler.should_profile(request.endpoint, get_user_id):
+        g.profile = request_profiler.start()
+        g.profile_started = time.perf_counter()
+
+@app.after_request
+def stop_request_profile(response):
+    """Store the profile of a sampled request."""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        try:
+            request_profiler.stop(
+                profile,
+                endpoint=request.endpoint,
+                path=request.path,
+                method=request.method,
+                user_id=current_user.id if current_user.is_authenticated else None,
+                status=response.status_code,
+                duration=time.perf_counter() - g.pop('profile_started')
+            )
+        except Exception as e:
+            app.logger.warning('Could not store request profile: %s', str(e))
+    return response
+
 # Routes
 @app.route('/')
 def index():
@@ -573,6 +1100,7 @@ def register():
         user.set_password(password)
         
         db.session.add(user)
+        stats.user_created()
         db.session.commit()
         
         flash('Registration successful! Please log in.', 'success')
@@ -610,8 +1138,28 @@ def logout():
 @login_required
 def dashboard():
     """User dashboard with document management."""
-    documents = Document.query.filter_by(user_id=current_user.id).order_by(Document.uploaded_at.desc()).all()
-    return render_template('dashboard.html', documents=documents)
+    documents, next_cursor = keyset_page(
+        Document.query.filter_by(user_id=current_user.id),
+        Document.uploaded_at, Document.id,
+        after=request.args.get('after'),
+        per_page=DOCUMENTS_PER_PAGE
+    )
+    
+    # Totals for the header and quick stats in one aggregate query
+    total_documents, total_chunks, latest_upload = db.session.query(
+        db.func.count(Document.id),
+        db.func.coalesce(db.func.sum(Document.chunk_count), 0),
+        db.func.max(Document.uploaded_at)
+    ).filter(Document.user_id == current_user.id).one()
+    
+    return render_template('dashboard.html',
+                         documents=documents,
+                         next_cursor=next_cursor,
+                         is_first_page=not request.args.get('after'),
+                         total_documents=total_documents,
+                         total_chunks=total_chunks,
+                         latest_upload=latest_upload,
+                         upload_max_mb=UPLOAD_MAX_MB)
 
 @app.route('/upload', methods=['POST'])
 @login_required
@@ -619,8 +1167,7 @@ def upload_file():
     """Handle file upload."""
     try:
         app.logger.info('Upload attempt by user_id=%s', getattr(current_user, 'id', None))
-        print(f"[UPLOAD] Request files: {list(request.files.keys())}")
-        print(f"[UPLOAD] Request form: {dict(request.form)}")
+        app.logger.debug('Upload request files: %s', list(request.files.keys()))
         
         if 'file' not in request.files:
             flash('No file selected.', 'error')
@@ -628,45 +1175,53 @@ def upload_file():
             return redirect(url_for('dashboard'))
         
         file = request.files['file']
-        print(f"[UPLOAD] File object: {file}")
-        print(f"[UPLOAD] Filename: {file.filename}")
+        app.logger.debug('Upload filename: %s', file.filename)
         
         if file.filename == '':
             flash('No file selected.', 'error')
             app.logger.warning('Upload failed: empty filename')
             return redirect(url_for('dashboard'))
+    except RequestEntityTooLarge:
+        raise  # reported by the 413 handler
     except Exception as e:
-        print(f"[UPLOAD] Error in initial checks: {str(e)}")
+        app.logger.exception('Upload failed in initial checks: %s', str(e))
         flash(f'Upload error: {str(e)}', 'error')
         return redirect(url_for('dashboard'))
     
     if file and allowed_file(file.filename):
         try:
-            print(f"[UPLOAD] Processing file: {file.filename}")
             # Generate unique filename
             original_filename = secure_filename(file.filename)
             file_extension = original_filename.rsplit('.', 1)[1].lower()
             unique_filename = f"{uuid.uuid4()}.{file_extension}"
             
-            print(f"[UPLOAD] Original: {original_filename}, Unique: {unique_filename}")
-            
             # Save file
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            print(f"[UPLOAD] Saving to: {file_path}")
         except Exception as e:
-            print(f"[UPLOAD] Error in file processing setup: {str(e)}")
+            app.logger.exception('Upload failed in processing setup: %s', str(e))
             flash(f'Error processing file: {str(e)}', 'error')
             return redirect(url_for('dashboard'))
-        app.logger.info('Saving upload to %s', file_path)
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        file.save(file_path)
-        app.logger.info('Saved file: %s (size=%s bytes)', file_path, os.path.getsize(file_path) if os.path.exists(file_path) else 'N/A')
+        
+        # The file was already spooled to disk, hashed and sniffed while the
+        # request was parsed; accepting it is a rename
+        upload = file.stream
+        if upload.size == 0:
+            flash('The uploaded file is empty.', 'error')
+            app.logger.warning('Upload failed: empty file %s', original_filename)
+            return redirect(url_for('dashboard'))
+        detected_type = upload.detected_type()
+        if detected_type != file_extension:
+            flash(f'The file content does not match its .{file_extension} extension.', 'error')
+            app.logger.warning('Upload failed: %s looks like %s', original_filename, detected_type)
+            return redirect(url_for('dashboard'))
+        upload.accept(file_path)
+        app.logger.info('Saved file: %s (size=%s bytes, sha256=%s)', file_path, upload.size, upload.sha256)
         
         try:
-            print(f"[UPLOAD] Extracting text from {file_extension} file...")
             # Extract text
-            text = extract_text_from_file(file_path, file_extension)
-            print(f"[UPLOAD] Extracted {len(text)} characters")
+            pages = extract_pages_from_file(file_path, file_extension)
+            text = ''.join(page_text for _, page_text in pages)
+            app.logger.info('Extracted %s characters from %s', len(text), original_filename)
             
             if not text.strip():
                 flash('Could not extract text from the file. Please ensure it contains readable text.', 'error')
@@ -680,30 +1235,41 @@ def upload_file():
                 user_id=current_user.id,
                 filename=unique_filename,
                 original_name=original_filename,
-                file_type=file_extension
+                file_type=file_extension,
+                content_hash=upload.sha256
             )
             db.session.add(document)
             db.session.commit()
             app.logger.info('Created Document id=%s for user_id=%s', document.id, current_user.id)
             
-            # Process text into chunks
-            chunks = chunk_text(text)
-            app.logger.info('Chunked text into %s chunks', len(chunks))
+            # Process text into chunks, without the repeated headers and footers
+            pages, chunks_saved = remove_boilerplate(pages)
+            chunks, page_spans = chunk_pages(pages)
+            app.logger.info('Chunked text into %s chunks (%s saved by boilerplate removal)',
+                            len(chunks), chunks_saved)
             
             # Add to FAISS index
-            chunk_count = add_document_to_faiss(
+            chunk_count, duplicates_linked = add_document_to_faiss(
                 current_user.id, 
                 document.id, 
                 chunks, 
-                original_filename
+                original_filename,
+                page_spans
             )
             
             # Update chunk count
             document.chunk_count = chunk_count
+            stats.document_added(current_user.id, file_extension, chunk_count)
             db.session.commit()
-            app.logger.info('Indexed document id=%s with %s chunks', document.id, chunk_count)
+            app.logger.info('Indexed document id=%s with %s chunks (%s linked as near-duplicates)',
+                            document.id, chunk_count, duplicates_linked)
             
-            flash(f'File "{original_filename}" uploaded successfully! Created {chunk_count} chunks.', 'success')
+            message = f'File "{original_filename}" uploaded successfully! Created {chunk_count} chunks'
+            if chunks_saved:
+                message += f' ({chunks_saved} fewer after removing repeated headers and footers)'
+            if duplicates_linked:
+                message += f'; {duplicates_linked} near-duplicate chunks were linked to existing ones instead of being embedded'
+            flash(message + '.', 'success')
         
         except Exception as e:
             # Clean up on error
@@ -724,8 +1290,10 @@ def upload_file():
 
 @app.errorhandler(413)
 def request_entity_too_large(error):
-    """Handle files exceeding MAX_CONTENT_LENGTH."""
-    flash('File too large. Maximum allowed size is 16MB.', 'error')
+    """Handle files exceeding UPLOAD_MAX_MB."""
+    if request.endpoint != 'upload_file':
+        return error
+    flash(f'File too large. Maximum allowed size is {UPLOAD_MAX_MB}MB.', 'error')
     app.logger.warning('Upload rejected: file too large')
     return redirect(url_for('dashboard'))
 
@@ -749,6 +1317,7 @@ def delete_document(document_id):
             os.remove(file_path)
         
         # Remove from database
+        stats.document_removed(current_user.id, document.file_type, document.chunk_count)
         db.session.delete(document)
         db.session.commit()
         
@@ -763,8 +1332,143 @@ def delete_document(document_id):
 @login_required
 def search_page():
     """Search page."""
-    documents = Document.query.filter_by(user_id=current_user.id).all()
-    return render_template('search.html', documents=documents)
+    return render_template('search.html',
+                         has_documents=user_has_documents(current_user.id),
+                         selected_document=get_user_document(request.args.get('doc_id', type=int)))
+
+def user_has_documents(user_id: int) -> bool:
+    """Whether the user has uploaded any document (an EXISTS query, no rows loaded)."""
+    return db.session.query(Document.query.filter_by(user_id=user_id).exists()).scalar()
+
+def get_user_document(document_id):
+    """The current user's document with this id, or None."""
+    if not document_id:
+        return None
+    return Document.query.filter_by(id=document_id, user_id=current_user.id).first()
+
+@app.route('/api/documents')
+@login_required
+def api_documents():
+    """Search the current user's documents by name, one keyset page at a time.
+
+    Query parameters: ``q`` (name substring), ``after`` (cursor from a
+    previous response) and ``limit`` (max 50). Used by the search page's
+    document picker.
+    """
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+    query = Document.query.filter_by(user_id=current_user.id)
+    name_filter = request.args.get('q', '').strip()
+    if name_filter:
+        escaped = name_filter.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(Document.original_name.ilike(f'%{escaped}%', escape='\\'))
+    
+    documents, next_cursor = keyset_page(query, Document.uploaded_at, Document.id,
+                                         after=request.args.get('after'), per_page=limit)
+    return jsonify({
+        'documents': [{
+            'id': doc.id,
+            'name': doc.original_name,
+            'file_type': doc.file_type,
+            'uploaded_at': doc.uploaded_at.isoformat() if doc.uploaded_at else None
+        } for doc in documents],
+        'next': next_cursor
+    })
+
+@app.route('/api/search', methods=['POST'])
+@login_required
+def api_search():
+    """Run a batch of retrieval queries and return ranked chunks as JSON.
+    
+    Request body::
+    
+        {"queries": ["text", {"query": "text", "document_id": 3}, ...],
+         "k": 5, "generate": false, "mmr": false}
+    
+    Each entry is a query string or an object with an optional document
+    filter. With ``generate`` set, an LLM answer is added per query from
+    the chunks passing ``select_relevant`` (null, without an LLM call, if
+    none do); ``mmr`` overrides SEARCH_MMR.
+    """
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'request body must be a JSON object'}), 400
+    entries = payload.get('queries')
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'queries must be a non-empty list'}), 400
+    if len(entries) > BATCH_SEARCH_MAX_QUERIES:
+        return jsonify({'error': f'at most {BATCH_SEARCH_MAX_QUERIES} queries per request'}), 400
+    
+    queries, document_ids = [], []
+    for entry in entries:
+        if isinstance(entry, dict):
+            query, document_id = entry.get('query'), entry.get('document_id')
+        else:
+            query, document_id = entry, None
+        if not isinstance(query, str) or not query.strip():
+            return jsonify({'error': 'every query must be a non-empty string'}), 400
+        # bool is an int subclass: reject true/false instead of searching document 1/0
+        if document_id not in (None, 'all') and (not isinstance(document_id, int) or isinstance(document_id, bool)):
+            return jsonify({'error': 'document_id must be an integer'}), 400
+        queries.append(query.strip())
+        document_ids.append(document_id if document_id != 'all' else None)
+    
+    try:
+        if isinstance(payload.get('k'), bool):
+            raise TypeError('k must not be a boolean')
+        k = min(max(int(payload.get('k', 5)), 1), BATCH_SEARCH_MAX_K)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'k must be an integer'}), 400
+    generate = bool(payload.get('generate', False))
+    mmr = payload.get('mmr')
+    if mmr is not None and not isinstance(mmr, bool):
+        return jsonify({'error': 'mmr must be a boolean'}), 400
+    
+    metrics.inc('batch_search_queries', len(queries))
+    results = search_faiss_index_batch(current_user.id, queries, k=k, document_ids=document_ids, mmr=mmr)
+    
+    response = []
+    for query, document_id, chunks in zip(queries, document_ids, results):
+        item = {
+            'query': query,
+            'document_id': document_id,
+            'results': [{key: chunk[key] for key in ('document_id', 'filename', 'chunk_index', 'page', 'text', 'score')}
+                        for chunk in chunks]
+        }
+        if generate:
+            relevant = select_relevant(chunks)
+            if chunks and not relevant:
+                metrics.inc('llm_calls_saved')
+            item['answer'] = generate_rag_response(query, relevant) if relevant else None
+        response.append(item)
+    return jsonify({'k': k, 'results': response})
+
+@app.route('/api/ask', methods=['POST'])
+@login_required
+def api_ask():
+    """Answer one question and stream the answer as plain text.
+    
+    Request body: ``{"query": "text", "document_id": 3}`` (the filter is
+    optional). Retrieval is the same as on the search page; the answer is
+    streamed token by token with LLM_PROVIDER=local, in one piece otherwise.
+    """
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'request body must be a JSON object'}), 400
+    query = payload.get('query')
+    document_id = payload.get('document_id')
+    if not isinstance(query, str) or not query.strip():
+        return jsonify({'error': 'query must be a non-empty string'}), 400
+    if document_id is not None and (not isinstance(document_id, int) or isinstance(document_id, bool)):
+        return jsonify({'error': 'document_id must be an integer'}), 400
+    
+    results = search_faiss_index(current_user.id, query.strip(), k=SEARCH_MAX_K, document_id=document_id,
+                                 highlight=False, adaptive=True)
+    if not results:
+        metrics.inc('llm_calls_saved')
+    response = Response(stream_with_context(stream_rag_response(query.strip(), results)),
+                        mimetype='text/plain')
+    response.headers['X-Accel-Buffering'] = 'no'  # let nginx pass tokens through as they come
+    return response
 
 @app.route('/search', methods=['POST'])
 @login_required
@@ -773,7 +1477,7 @@ def search():
     query = request.form.get('query', '').strip()
     document_id = request.form.get('document_id')
     
-    print(f"[SEARCH] User {current_user.id} searching for: '{query}'")
+    app.logger.debug('Search by user_id=%s', current_user.id)
     
     if not query:
         flash('Please enter a search query.', 'error')
@@ -781,50 +1485,44 @@ def search():
     
     try:
         # Check if user has any documents
-        user_documents = Document.query.filter_by(user_id=current_user.id).all()
-        print(f"[SEARCH] User has {len(user_documents)} documents")
-        
-        if not user_documents:
+        if not user_has_documents(current_user.id):
             flash('You need to upload documents before searching. Please upload some documents first.', 'warning')
             return redirect(url_for('dashboard'))
         
         # Convert document_id to int if provided
         doc_id = int(document_id) if document_id and document_id != 'all' else None
-        print(f"[SEARCH] Searching in document_id: {doc_id}")
+        selected_document = get_user_document(doc_id)
         
-        # Search FAISS index
-        results = search_faiss_index(current_user.id, query, k=5, document_id=doc_id)
-        print(f"[SEARCH] Found {len(results)} results")
+        # Search FAISS index, keeping only chunks that score well enough
+        results = search_faiss_index(current_user.id, query, k=SEARCH_MAX_K, document_id=doc_id, adaptive=True)
+        app.logger.debug('Search returned %s results (document_id=%s)', len(results), doc_id)
         
         if not results:
             # Check if FAISS index exists and has content
-            index, metadata = load_or_create_faiss_index(current_user.id)
-            print(f"[SEARCH] FAISS index has {index.ntotal} vectors, {len(metadata)} metadata entries")
-            
-            if index.ntotal == 0:
+            if count_indexed_chunks(current_user.id) == 0:
                 flash('Your documents are still being processed. Please try again in a moment, or re-upload your documents.', 'warning')
             else:
+                # Nothing cleared the score cutoff: answer without calling the LLM
+                metrics.inc('llm_calls_saved')
                 flash('No relevant information found for your query. Try rephrasing your question or using different keywords.', 'info')
             
             return render_template('search.html',
-                                 documents=user_documents,
+                                 has_documents=True,
+                                 selected_document=selected_document,
                                  query=query)
         
         # Generate RAG response
-        print(f"[SEARCH] Generating RAG response...")
         answer = generate_rag_response(query, results)
-        print(f"[SEARCH] Generated answer: {len(answer)} characters")
         
         return render_template('search.html',
-                             documents=user_documents,
+                             has_documents=True,
+                             selected_document=selected_document,
                              query=query,
                              answer=answer,
                              sources=results)
     
     except Exception as e:
-        print(f"[SEARCH] Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        app.logger.exception('Error processing search: %s', str(e))
         flash(f'Error processing search: {str(e)}', 'error')
         return redirect(url_for('search_page'))
 
@@ -844,7 +1542,54 @@ def download_document(document_id):
         flash('File not found on server.', 'error')
         return redirect(url_for('dashboard'))
     
-    return send_file(file_path, as_attachment=True, download_name=document.original_name)
+    # Strong ETag from the content hash; documents uploaded before hashes
+    # were stored get theirs computed once, on first download
+    if not document.content_hash:
+        document.content_hash = file_sha256(file_path)
+        db.session.commit()
+    
+    # ?inline=1 lets the browser's PDF viewer open the file in place
+    as_attachment = not request.args.get('inline')
+    
+    if DOWNLOAD_OFFLOAD in ('x-accel', 'x-sendfile'):
+        response = Response(mimetype=mimetypes.guess_type(document.original_name)[0] or 'application/octet-stream')
+        if DOWNLOAD_OFFLOAD == 'x-accel':
+            response.headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX + document.filename
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(file_path)
+        response.headers['Content-Disposition'] = _content_disposition(document.original_name, as_attachment)
+        response.set_etag(document.content_hash)
+        response.last_modified = os.path.getmtime(file_path)
+        # The front-end server sends the bytes and handles range requests
+        # itself; only 304s are answered here
+        response = response.make_conditional(request)
+    else:
+        # conditional=True answers If-None-Match / If-Modified-Since with 304
+        # and Range requests with 206 partial content
+        response = send_file(file_path, as_attachment=as_attachment, download_name=document.original_name,
+                             conditional=True, etag=document.content_hash)
+        # Advertise ranges up front so PDF viewers can fetch pages on demand
+        response.accept_ranges = 'bytes'
+    response.cache_control.private = True
+    return response
+
+def _content_disposition(filename: str, as_attachment: bool) -> str:
+    """Content-Disposition header value, with an RFC 5987 name for non-ASCII filenames."""
+    from urllib.parse import quote
+    disposition = 'attachment' if as_attachment else 'inline'
+    try:
+        filename.encode('ascii')
+        return f'{disposition}; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"{disposition}; filename*=UTF-8''{quote(filename)}"
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for pipeline stage latencies and index caches."""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 # Admin Routes
 @app.route('/admin')
@@ -852,32 +1597,34 @@ def download_document(document_id):
 @admin_required
 def admin_dashboard():
     """Admin dashboard with analytics."""
-    # Get statistics
-    total_users = User.query.count()
-    total_documents = Document.query.count()
-    total_chunks = db.session.query(db.func.sum(Document.chunk_count)).scalar() or 0
+    # Precomputed counters, maintained on upload/delete/registration and
+    # periodically reconciled against the full tables
+    stats.reconcile_if_stale(STATS_RECONCILE_INTERVAL)
+    counters = stats.read_stats()
+    total_users = counters.get('users', 0)
+    total_documents = counters.get('documents', 0)
+    total_chunks = counters.get('chunks', 0)
     
     # Recent users (last 10)
     recent_users = User.query.order_by(User.created_at.desc()).limit(10).all()
     
-    # Recent documents (last 10)
-    recent_documents = Document.query.order_by(Document.uploaded_at.desc()).limit(10).all()
+    # Recent documents (last 10), with their owners loaded in the same query
+    recent_documents = Document.query.options(db.joinedload(Document.user)).order_by(
+        Document.uploaded_at.desc()
+    ).limit(10).all()
     
     # User statistics
-    users_with_docs = db.session.query(User).join(Document).distinct().count()
+    users_with_docs = counters.get('users_with_docs', 0)
     users_without_docs = total_users - users_with_docs
     
     # Document statistics by type
-    doc_stats = db.session.query(
-        Document.file_type,
-        db.func.count(Document.id).label('count')
-    ).group_by(Document.file_type).all()
+    doc_stats = sorted(
+        (name.split(':', 1)[1], count) for name, count in counters.items()
+        if name.startswith('documents:') and count > 0
+    )
     
     # Top users by document count
-    top_users = db.session.query(
-        User,
-        db.func.count(Document.id).label('doc_count')
-    ).join(Document).group_by(User.id).order_by(db.desc('doc_count')).limit(5).all()
+    top_users = stats.top_users(5)
     
     return render_template('admin_dashboard.html',
                          total_users=total_users,
@@ -895,22 +1642,98 @@ def admin_dashboard():
 @admin_required
 def admin_users():
     """Admin page to view all users."""
-    users = User.query.order_by(User.created_at.desc()).all()
-    
-    # Get document count for each user
-    user_stats = []
-    for user in users:
-        doc_count = Document.query.filter_by(user_id=user.id).count()
-        chunk_count = db.session.query(db.func.sum(Document.chunk_count)).filter(
-            Document.user_id == user.id
-        ).scalar() or 0
-        user_stats.append({
-            'user': user,
-            'doc_count': doc_count,
-            'chunk_count': chunk_count
-        })
-    
-    return render_template('admin_users.html', user_stats=user_stats)
+    # Per-user totals come from the incrementally maintained user_stats
+    # table, so each page costs one indexed seek regardless of table sizes
+    stats.reconcile_if_stale(STATS_RECONCILE_INTERVAL)
+    rows, next_cursor = keyset_page(
+        db.session.query(
+            User,
+            db.func.coalesce(UserStat.doc_count, 0),
+            db.func.coalesce(UserStat.chunk_count, 0)
+        ).outerjoin(UserStat, UserStat.user_id == User.id),
+        User.created_at, User.id,
+        after=request.args.get('after'),
+        per_page=ADMIN_USERS_PER_PAGE,
+        key=lambda row: (row[0].created_at, row[0].id)
+    )
+    
+    user_stats = [{
+        'user': user,
+        'doc_count': doc_count,
+        'chunk_count': chunk_count
+    } for user, doc_count, chunk_count in rows]
+    
+    # Totals for the summary cards
+    counters = stats.read_stats()
+    admin_count = User.query.filter_by(is_admin=True).count()
+    
+    return render_template('admin_users.html',
+                         user_stats=user_stats,
+                         next_cursor=next_cursor,
+                         is_first_page=not request.args.get('after'),
+                         total_users=counters.get('users', 0),
+                         admin_count=admin_count,
+                         total_documents=counters.get('documents', 0))
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def admin_profiling():
+    """Configure request profiling and list captured profiles."""
+    if request.method == 'POST':
+        try:
+            request_profiler.update_settings(
+                enabled=request.form.get('enabled') == 'on',
+                sample_rate=request.form.get('sample_rate', 100),
+                user_id=request.form.get('user_id', '').strip() or None,
+                endpoint=request.form.get('endpoint', '')
+            )
+            flash('Profiling settings updated.', 'success')
+        except ValueError:
+            flash('Sample rate and user ID must be numbers.', 'error')
+        return redirect(url_for('admin_profiling'))
+    
+    endpoints = sorted(rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != 'static')
+    return render_template('admin_profiling.html',
+                         settings=request_profiler.settings,
+                         profiles=request_profiler.list_profiles(),
+                         endpoints=endpoints)
+
+@app.route('/admin/profiling/<name>')
+@login_required
+@admin_required
+def admin_view_profile(name):
+    """Show the top functions of a captured profile."""
+    if not request_profiler.profile_path(name):
+        flash('Profile not found.', 'error')
+        return redirect(url_for('admin_profiling'))
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'ncalls'):
+        sort = 'cumulative'
+    return render_template('admin_profile_view.html',
+                         name=name,
+                         sort=sort,
+                         report=request_profiler.summary(name, sort=sort))
+
+@app.route('/admin/profiling/<name>/download')
+@login_required
+@admin_required
+def admin_download_profile(name):
+    """Download a captured profile as a .prof file."""
+    path = request_profiler.profile_path(name)
+    if not path:
+        flash('Profile not found.', 'error')
+        return redirect(url_for('admin_profiling'))
+    return send_file(path, as_attachment=True, download_name=name + '.prof')
+
+@app.route('/admin/profiling/clear', methods=['POST'])
+@login_required
+@admin_required
+def admin_clear_profiles():
+    """Delete all captured profiles."""
+    request_profiler.clear()
+    flash('All profiles deleted.', 'success')
+    return redirect(url_for('admin_profiling'))
 
 @app.route('/admin/user/<int:user_id>/toggle_admin', methods=['POST'])
 @login_required
@@ -951,11 +1774,12 @@ def admin_delete_user(user_id):
                 os.remove(file_path)
         
         # Remove FAISS index directory
-        user_faiss_dir = os.path.join(app.config['FAISS_FOLDER'], str(user_id))
-        if os.path.exists(user_faiss_dir):
-            shutil.rmtree(user_faiss_dir)
+        index_store.remove(user_id)
+        result_cache.invalidate(user_id)
+        lsh_cache.invalidate(user_id)
         
         # Delete user (cascade will delete documents)
+        stats.user_removed(user_id)
         db.session.delete(user)
         db.session.commit()
         
@@ -966,6 +1790,10 @@ def admin_delete_user(user_id):
     return redirect(url_for('admin_users'))
 
 if __name__ == '__main__':
+    # Extraction pool workers start by importing the main module, which here
+    # is this whole app, embedding model included: extract PDFs in this
+    # process instead (gunicorn and run.py keep the pool)
+    PDF_EXTRACT_WORKERS = 1
     create_directories()
     
     with app.app_context():
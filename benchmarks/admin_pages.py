@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark the admin pages against a seeded database
+
+Seeds a scratch SQLite database with many users and documents, logs in as an
+admin and times GET /admin and GET /admin/users, counting SQL statements per
+request.
+
+Usage:
+    python benchmarks/admin_pages.py [--users 10000] [--docs-per-user 3] [--requests 20]
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# Add project root to path
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+ADMIN_EMAIL = 'bench-admin@example.com'
+ADMIN_PASSWORD = 'Bench-Admin-1'
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)]
+
+def seed(db, User, Document, users, docs_per_user, seed_value=42):
+    """Bulk insert users and documents (password hashing only for the admin)."""
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed_value)
+    start = datetime(2024, 1, 1)
+    admin = User(username='bench-admin', email=ADMIN_EMAIL, is_admin=True,
+                 password_hash=generate_password_hash(ADMIN_PASSWORD), created_at=start)
+    db.session.add(admin)
+    db.session.commit()
+
+    dummy_hash = admin.password_hash
+    user_rows = [{
+        'username': f'user{n}',
+        'email': f'user{n}@example.com',
+        'password_hash': dummy_hash,
+        'is_admin': False,
+        'created_at': start + timedelta(minutes=n),
+    } for n in range(users)]
+    db.session.execute(User.__table__.insert(), user_rows)
+    db.session.commit()
+
+    user_ids = [row[0] for row in db.session.execute(db.select(User.id)).all()]
+    doc_rows = []
+    for user_id in user_ids:
+        for n in range(rng.randint(0, 2 * docs_per_user)):
+            file_type = rng.choice(['pdf', 'docx', 'txt'])
+            doc_rows.append({
+                'user_id': user_id,
+                'filename': f'{user_id}-{n}.{file_type}',
+                'original_name': f'report-{n}.{file_type}',
+                'file_type': file_type,
+                'uploaded_at': start + timedelta(minutes=user_id, seconds=n),
+                'chunk_count': rng.randint(1, 200),
+            })
+    db.session.execute(Document.__table__.insert(), doc_rows)
+    db.session.commit()
+    return len(user_ids), len(doc_rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the admin pages")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--docs-per-user', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='askmydocs-admin-bench-')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(work_dir, 'bench.sqlite3')
+
+    from sqlalchemy import event
+    import app as rag
+    from models import db, User, Document
+
+    with rag.app.app_context():
+        db.create_all()
+        print(f"🔄 Seeding {args.users} users...")
+        users, documents = seed(db, User, Document, args.users, args.docs_per_user)
+        engine = db.engine
+
+    statements = [0]
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_statement(*_):
+        statements[0] += 1
+
+    client = rag.app.test_client()
+    client.post('/login', data={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+
+    report = {'users': users, 'documents': documents, 'pages': {}}
+    for path in ('/admin', '/admin/users'):
+        timings = []
+        for _ in range(args.requests):
+            statements[0] = 0
+            start = time.perf_counter()
+            response = client.get(path)
+            timings.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                print(f"❌ {path} returned {response.status_code}")
+                break
+        report['pages'][path] = {
+            'sql_statements': statements[0],
+            'html_kb': round(len(response.data) / 1024, 1),
+            'p50_ms': round(percentile(timings, 50) * 1000, 2),
+            'p95_ms': round(percentile(timings, 95) * 1000, 2),
+        }
+        print(f"✅ {path}: p50 {report['pages'][path]['p50_ms']} ms, "
+              f"{statements[0]} SQL statements")
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+if __name__ == '__main__':
+    main()
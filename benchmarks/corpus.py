@@ -0,0 +1,119 @@
+"""
+Deterministic synthetic corpus generator for the benchmarks
+
+Produces TXT, PDF and DOCX documents of several sizes from a fixed vocabulary
+and seed, so two runs on different commits process exactly the same input.
+Documents are paginated and carry a repeated header and footer line like
+typical corporate files.
+"""
+import os
+import random
+
+VOCABULARY = (
+    "agreement audit balance board budget capacity clause compliance contract "
+    "customer data deadline delivery department deployment employee estimate "
+    "finance forecast governance incident inventory invoice liability license "
+    "maintenance manager margin milestone network notice obligation operations "
+    "party payment performance policy procedure product project quality quarter "
+    "recovery regulation release renewal report requirement revenue review risk "
+    "safety schedule security server service software supplier support system "
+    "termination training upgrade vendor warranty workflow"
+).split()
+
+# name -> approximate words per document
+SIZES = {
+    'small': 400,
+    'medium': 5000,
+    'large': 40000,
+}
+
+WORDS_PER_PAGE = 450
+
+def make_sentence(rng):
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 24))]
+    words[0] = words[0].capitalize()
+    return ' '.join(words) + '.'
+
+def make_pages(rng, word_count, title):
+    """Return a list of page texts (header, body paragraphs, footer)."""
+    pages = []
+    page_number = 1
+    remaining = word_count
+    while remaining > 0:
+        body_words = 0
+        paragraphs = []
+        while body_words < min(WORDS_PER_PAGE, remaining):
+            paragraph = ' '.join(make_sentence(rng) for _ in range(rng.randint(2, 5)))
+            paragraphs.append(paragraph)
+            body_words += len(paragraph.split())
+        remaining -= body_words
+        header = f"{title} - Confidential"
+        footer = f"Acme Corporation. All rights reserved. Page {page_number}"
+        pages.append('\n'.join([header] + paragraphs + [footer]))
+        page_number += 1
+    return pages
+
+def write_txt(path, pages):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(pages))
+
+def write_pdf(path, pages):
+    import fitz  # PyMuPDF
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), text, fontsize=8)
+    doc.save(path)
+    doc.close()
+
+def write_docx(path, pages):
+    import docx
+    document = docx.Document()
+    for text in pages:
+        for line in text.split('\n'):
+            document.add_paragraph(line)
+    document.save(path)
+
+WRITERS = {
+    'txt': write_txt,
+    'pdf': write_pdf,
+    'docx': write_docx,
+}
+
+def generate_corpus(output_dir, docs_per_size=3, sizes=None, file_types=None, seed=42):
+    """Write the corpus to ``output_dir`` and return a list of document descriptors.
+
+    Each descriptor is a dict with ``path``, ``file_type``, ``size`` and ``words``.
+    """
+    rng = random.Random(seed)
+    sizes = sizes or list(SIZES)
+    file_types = file_types or list(WRITERS)
+    os.makedirs(output_dir, exist_ok=True)
+
+    corpus = []
+    for size in sizes:
+        for file_type in file_types:
+            for n in range(docs_per_size):
+                title = f"{size.capitalize()} {file_type.upper()} Report {n + 1}"
+                pages = make_pages(rng, SIZES[size], title)
+                path = os.path.join(output_dir, f"{size}_{n + 1}.{file_type}")
+                WRITERS[file_type](path, pages)
+                corpus.append({
+                    'path': path,
+                    'file_type': file_type,
+                    'size': size,
+                    'words': sum(len(p.split()) for p in pages),
+                })
+    return corpus
+
+def make_queries(count, seed=7):
+    """Deterministic search queries drawn from the corpus vocabulary."""
+    rng = random.Random(seed)
+    templates = [
+        "What does the {a} say about {b}?",
+        "Summarize the {a} and {b} requirements",
+        "When is the {a} {b} deadline?",
+        "Who is responsible for {a} {b}?",
+    ]
+    return [rng.choice(templates).format(a=rng.choice(VOCABULARY), b=rng.choice(VOCABULARY))
+            for _ in range(count)]
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark DOCX text extraction: streaming XML parse vs python-docx
+
+Usage:
+    python benchmarks/docx_extraction.py [--sizes small medium large] [--repeat 3]
+
+Each generated document carries a small table on every page, so the report
+also shows how much table text each extractor recovers.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import docx
+
+from corpus import SIZES, VOCABULARY, make_pages
+from extraction import extract_docx_text
+
+def write_docx_with_tables(path, pages, rng):
+    """Like corpus.write_docx, plus a 4x3 table after each page's body."""
+    document = docx.Document()
+    cells = []
+    for text in pages:
+        for line in text.split('\n'):
+            document.add_paragraph(line)
+        table = document.add_table(rows=4, cols=3)
+        for row in table.rows:
+            for cell in row.cells:
+                cell.text = f"{rng.choice(VOCABULARY)} {rng.randint(100, 999)}"
+                cells.append(cell.text)
+    document.save(path)
+    return cells
+
+def python_docx_paragraphs(path):
+    """The previous extraction path: body paragraphs only."""
+    doc = docx.Document(path)
+    text = ""
+    for paragraph in doc.paragraphs:
+        text += paragraph.text + "\n"
+    return text
+
+def best_time(function, path, repeat):
+    """Fastest of ``repeat`` runs, and the extracted text."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = function(path)
+        timings.append(time.perf_counter() - start)
+    return min(timings), text
+
+def table_coverage(text, cells):
+    """Fraction of table cell texts found in the extracted text."""
+    found = sum(1 for cell in cells if cell in text)
+    return round(found / len(cells), 3) if cells else 1.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', nargs='+', default=list(SIZES), choices=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    extractors = [
+        ('python-docx', python_docx_paragraphs),
+        ('streaming', extract_docx_text),
+    ]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            path = os.path.join(workdir, f"{size}.docx")
+            pages = make_pages(rng, SIZES[size], f"{size.capitalize()} DOCX Report")
+            cells = write_docx_with_tables(path, pages, rng)
+
+            entry = {'pages': len(pages), 'file_bytes': os.path.getsize(path)}
+            for label, function in extractors:
+                seconds, text = best_time(function, path, args.repeat)
+                entry[label] = {
+                    'seconds': round(seconds, 4),
+                    'chars': len(text),
+                    'table_coverage': table_coverage(text, cells),
+                }
+            entry['speedup'] = round(entry['python-docx']['seconds'] / entry['streaming']['seconds'], 2)
+            results[size] = entry
+            print(f"✅ {size}: {entry['speedup']}x faster, tables "
+                  f"{entry['python-docx']['table_coverage']:.0%} -> {entry['streaming']['table_coverage']:.0%}")
+
+    print(json.dumps({'repeat': args.repeat, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark embedding backends: throughput and drift against SentenceTransformer
+
+Usage:
+    python benchmarks/embedding_backends.py [--sentences 2000] [--batch-size 32]
+
+Requires the ONNX graphs exported by export_onnx_model.py.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from embeddings import load_embedding_model, DEFAULT_MODEL_NAME
+
+WORDS = (
+    "contract agreement party clause liability payment term notice invoice report "
+    "revenue growth quarter customer product service policy employee training safety "
+    "system network server data security access review audit compliance risk budget "
+    "project schedule delivery milestone requirement design test release support"
+).split()
+
+def make_sentences(count, seed=0):
+    """Generate deterministic pseudo-sentences of mixed lengths."""
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(count):
+        length = rng.choice([8, 16, 32, 64, 128])
+        sentences.append(' '.join(rng.choice(WORDS) for _ in range(length)) + '.')
+    return sentences
+
+def time_backend(model, sentences, batch_size):
+    """Encode all sentences once for warm-up, then time a second pass."""
+    model.encode(sentences[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    embeddings = model.encode(sentences, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    return embeddings, elapsed
+
+def drift(reference, candidate):
+    """Cosine similarity between reference and candidate embeddings, row by row."""
+    ref = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cand = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosine = (ref * cand).sum(axis=1)
+    return {
+        'mean_cosine': float(cosine.mean()),
+        'min_cosine': float(cosine.min()),
+        'max_abs_diff': float(np.abs(reference - candidate).max())
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sentences', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--model', default=os.getenv('EMBEDDING_MODEL', DEFAULT_MODEL_NAME))
+    parser.add_argument('--onnx-dir', default=None)
+    args = parser.parse_args()
+
+    sentences = make_sentences(args.sentences)
+    configs = [
+        ('sentence-transformers', {}),
+        ('onnx-fp32', {'onnx_quantized': False}),
+        ('onnx-int8', {'onnx_quantized': True}),
+    ]
+
+    results = {}
+    reference = None
+    for label, kwargs in configs:
+        backend = 'sentence-transformers' if label == 'sentence-transformers' else 'onnx'
+        try:
+            model = load_embedding_model(backend, model_name=args.model,
+                                         onnx_model_dir=args.onnx_dir, **kwargs)
+        except Exception as e:
+            print(f"❌ {label}: {e}")
+            continue
+
+        embeddings, elapsed = time_backend(model, sentences, args.batch_size)
+        entry = {
+            'dimension': int(embeddings.shape[1]),
+            'seconds': round(elapsed, 4),
+            'sentences_per_second': round(len(sentences) / elapsed, 1)
+        }
+        if label == 'sentence-transformers':
+            reference = embeddings
+        elif reference is not None:
+            entry['drift'] = drift(reference, embeddings)
+            entry['speedup'] = round(results['sentence-transformers']['seconds'] / elapsed, 2)
+        results[label] = entry
+        print(f"✅ {label}: {entry['sentences_per_second']} sentences/s")
+
+    print(json.dumps({'sentences': len(sentences), 'batch_size': args.batch_size,
+                      'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Reproducible performance benchmark for the RAG pipeline
+
+Generates a synthetic corpus, then times each stage of the ingest and search
+paths with the LLM stubbed out:
+
+    extract -> chunk -> add_document_to_faiss -> search_faiss_index
+    -> highlight -> prompt build + stub LLM -> remove_document_from_faiss
+
+Results (throughput, p50/p95/p99 latency per stage and peak RSS) are printed
+and written as JSON so runs on different commits can be compared.
+
+Usage:
+    python benchmarks/rag_pipeline.py [--docs-per-size 3] [--queries 50]
+                                      [--sizes small,medium] [--output bench.json]
+                                      [--baseline previous.json]
+                                      [--search-mode two_stage --coarse sq8 --candidates 200]
+                                      [--adaptive] [--local-llm --llm-token-ms 20]
+
+With --search-mode two_stage the report also includes recall@k of the
+two-stage results against exact search. With --adaptive the search results
+go through the score cutoffs of the /search route, and queries left without
+a chunk skip the LLM (counted as llm_calls_saved). With --local-llm the stub is
+replaced by the deterministic local provider (LLM_PROVIDER=local), so the
+answers are real extractive answers with per-token latency.
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+# Add project root to path
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from corpus import generate_corpus, make_queries, SIZES
+
+STUB_ANSWER = "Stubbed answer used for benchmarking."
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)
+    return ordered[rank]
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+class StageTimer:
+    """Collect wall-clock samples per stage."""
+
+    def __init__(self):
+        self.samples = {}
+        self.items = {}
+
+    def time(self, stage, func, *args, items=1, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        self.items[stage] = self.items.get(stage, 0) + items
+        return result
+
+    def report(self):
+        report = {}
+        for stage, samples in self.samples.items():
+            total = sum(samples)
+            report[stage] = {
+                'count': len(samples),
+                'total_s': round(total, 4),
+                'throughput_per_s': round(self.items[stage] / total, 2) if total else None,
+                'p50_ms': round(percentile(samples, 50) * 1000, 3),
+                'p95_ms': round(percentile(samples, 95) * 1000, 3),
+                'p99_ms': round(percentile(samples, 99) * 1000, 3),
+            }
+        return report
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=PROJECT_DIR, text=True).strip()
+    except Exception:
+        return None
+
+def run(args):
+    import app as rag
+
+    work_dir = tempfile.mkdtemp(prefix='askmydocs-bench-')
+    corpus_dir = os.path.join(work_dir, 'corpus')
+    faiss_dir = os.path.join(work_dir, 'faiss_indexes')
+
+    # Point the index store at a scratch directory; the database is not used
+    rag.app.config['FAISS_FOLDER'] = faiss_dir
+    rag.index_store.root = faiss_dir
+    if args.search_mode == 'two_stage':
+        rag.index_store.coarse_type = args.coarse
+    if not args.result_cache:
+        rag.result_cache.max_entries = 0  # time every search, even repeated queries
+
+    def stub_llm(query, context_chunks):
+        rag._build_context_and_prompt(query, context_chunks)
+        if args.llm_latency_ms:
+            time.sleep(args.llm_latency_ms / 1000.0)
+        return STUB_ANSWER
+
+    llm = stub_llm
+    if args.local_llm:
+        rag.local_llm.latency_ms = args.llm_latency_ms
+        rag.local_llm.token_ms = args.llm_token_ms
+        llm = rag.generate_rag_response_local
+
+    print("🔄 Generating corpus...")
+    corpus = generate_corpus(corpus_dir, docs_per_size=args.docs_per_size,
+                             sizes=args.sizes, file_types=args.file_types, seed=args.seed)
+    queries = make_queries(args.queries, seed=args.seed)
+    timer = StageTimer()
+    user_id = 1
+    chunk_total = 0
+    chunks_saved = 0
+    chunks_linked = 0
+    llm_calls_saved = 0
+    recall_hits = recall_total = 0
+
+    try:
+        print(f"📥 Ingesting {len(corpus)} documents...")
+        for document_id, doc in enumerate(corpus, start=1):
+            pages = timer.time('extract', rag.extract_pages_from_file, doc['path'], doc['file_type'])
+            pages, saved = timer.time('boilerplate', rag.remove_boilerplate, pages)
+            chunks, page_spans = timer.time('chunk', rag.chunk_pages, pages)
+            _, linked = timer.time('add_document_to_faiss', rag.add_document_to_faiss,
+                                   user_id, document_id, chunks, os.path.basename(doc['path']), page_spans,
+                                   items=len(chunks))
+            chunk_total += len(chunks)
+            chunks_linked += linked
+            chunks_saved += saved
+
+        print(f"🔍 Running {len(queries)} queries...")
+        for query in queries:
+            # Search without highlighting, then time highlighting separately
+            results = timer.time('search_faiss_index', rag.search_faiss_index,
+                                 user_id, query, k=args.k, highlight=False, mode=args.search_mode)
+            if args.search_mode == 'two_stage':
+                exact = rag.search_faiss_index(user_id, query, k=args.k, highlight=False, mode='exact')
+                expected = {(r['document_id'], r['chunk_index']) for r in exact}
+                recall_hits += len(expected & {(r['document_id'], r['chunk_index']) for r in results})
+                recall_total += len(expected)
+            if args.adaptive:
+                results = timer.time('score_cutoff', rag.select_relevant, results)
+                if not results:
+                    llm_calls_saved += 1
+                    continue
+            for result in results:
+                timer.time('highlight', rag.highlight_relevant_content, result['text'], query)
+            timer.time('prompt_and_llm', llm, query, results)
+
+        print("🗑️  Deleting documents...")
+        for document_id in range(1, len(corpus) + 1):
+            timer.time('remove_document_from_faiss', rag.remove_document_from_faiss,
+                       user_id, document_id)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'embedding_backend': getattr(rag, 'EMBEDDING_BACKEND', None),
+        'config': {
+            'docs_per_size': args.docs_per_size,
+            'sizes': args.sizes,
+            'file_types': args.file_types,
+            'queries': args.queries,
+            'k': args.k,
+            'seed': args.seed,
+            'llm_latency_ms': args.llm_latency_ms,
+            'local_llm': args.local_llm,
+            'llm_token_ms': args.llm_token_ms if args.local_llm else None,
+            'adaptive': args.adaptive,
+            'result_cache': args.result_cache,
+            'search_mode': args.search_mode,
+            'coarse': args.coarse if args.search_mode == 'two_stage' else None,
+            'candidates': rag.TWO_STAGE_CANDIDATES if args.search_mode == 'two_stage' else None,
+        },
+        'corpus': {
+            'documents': len(corpus),
+            'words': sum(doc['words'] for doc in corpus),
+            'chunks': chunk_total,
+            'boilerplate_chunks_saved': chunks_saved,
+            'duplicate_chunks_linked': chunks_linked,
+        },
+        'stages': timer.report(),
+        'recall_at_k': round(recall_hits / recall_total, 4) if recall_total else None,
+        'llm_calls_saved': llm_calls_saved if args.adaptive else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def compare(report, baseline):
+    """Print per-stage p50/p95 changes against a previous report."""
+    print(f"\n📊 Compared with {baseline.get('git_revision') or 'baseline'}:")
+    for stage, current in report['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if not previous:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            if previous[key]:
+                change = (current[key] - previous[key]) / previous[key] * 100
+                print(f"   {stage:<28} {key}: {previous[key]:>10.3f} -> {current[key]:>10.3f} ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RAG pipeline")
+    parser.add_argument('--docs-per-size', type=int, default=3)
+    parser.add_argument('--sizes', default=','.join(SIZES),
+                        help="comma-separated subset of: " + ', '.join(SIZES))
+    parser.add_argument('--file-types', default='txt,pdf,docx')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0,
+                        help="artificial latency of the stubbed LLM")
+    parser.add_argument('--local-llm', action='store_true',
+                        help="answer with the local extractive LLM instead of the stub")
+    parser.add_argument('--llm-token-ms', type=float, default=0.0,
+                        help="delay between tokens of the local LLM")
+    parser.add_argument('--search-mode', choices=['exact', 'two_stage'], default='exact')
+    parser.add_argument('--coarse', choices=['sq8', 'binary'], default='sq8',
+                        help="coarse index type for two-stage search")
+    parser.add_argument('--candidates', type=int, default=None,
+                        help="two-stage candidates re-scored per query")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="apply the score cutoffs and skip the LLM when no chunk passes")
+    parser.add_argument('--result-cache', action='store_true',
+                        help="serve repeated queries from the search result cache")
+    parser.add_argument('--output', default=None, help="write the JSON report to this file")
+    parser.add_argument('--baseline', default=None, help="previous JSON report to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep the generated corpus and indexes")
+    args = parser.parse_args()
+    args.sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    args.file_types = [t.strip() for t in args.file_types.split(',') if t.strip()]
+
+    if args.candidates:
+        os.environ['TWO_STAGE_CANDIDATES'] = str(args.candidates)
+    report = run(args)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        print(f"✅ Report written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Measure gunicorn worker memory with and without preloading the app
+
+Usage:
+    python benchmarks/worker_memory.py [--backend sentence-transformers|onnx]
+                                       [--workers 4] [--searches 60] [--output mem.json]
+
+Starts gunicorn twice from a scratch copy of the project: once with
+gunicorn.conf.py as shipped (app and model preloaded in the master, shared
+copy-on-write), once with every worker importing the app itself. Each run
+registers a few users, uploads a document per user and runs searches, so
+every worker embeds. RSS, PSS and USS (private pages) of the master and the
+workers are read from /proc/<pid>/smaps_rollup when idle and after the load
+(Linux only). RSS counts shared pages in every process, so the sharing shows
+in PSS and USS.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import http.cookiejar
+import urllib.parse
+import urllib.request
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Every worker imports the app and loads its own model, as before preload_app
+PER_WORKER_CONFIG = """
+exec(open({config!r}).read())
+preload_app = False
+def when_ready(server):
+    pass
+def post_fork(server, worker):
+    pass
+"""
+
+def memory_mb(pid):
+    """RSS, PSS and USS of a process in MB."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[1].isdigit():
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {'rss': fields['Rss'] // 1024, 'pss': fields['Pss'] // 1024,
+            'uss': (fields['Private_Clean'] + fields['Private_Dirty']) // 1024}
+
+def worker_pids(master_pid):
+    """gunicorn workers of a master (not the PDF extraction fork server)."""
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+            children = [int(pid) for pid in f.read().split()]
+    except FileNotFoundError:
+        return []
+    pids = []
+    for pid in children:
+        with open(f'/proc/{pid}/cmdline') as f:
+            if 'gunicorn' in f.read():
+                pids.append(pid)
+    return pids
+
+def snapshot(master_pid):
+    workers = [memory_mb(pid) for pid in worker_pids(master_pid)]
+    master = memory_mb(master_pid)
+    return {
+        'master': master,
+        'worker_avg': {key: round(sum(w[key] for w in workers) / len(workers)) for key in ('rss', 'pss', 'uss')},
+        'total_pss': master['pss'] + sum(w['pss'] for w in workers),
+    }
+
+def run_load(base_url, users, searches, seed):
+    """Register users, upload one document each and run searches."""
+    rng = random.Random(seed)
+    words = [f"term{i}" for i in range(2000)]
+    openers = []
+    for u in range(users):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        post = lambda url, data: opener.open(base_url + url, urllib.parse.urlencode(data).encode()).read()
+        email = f"bench{u}@example.com"
+        post('/register', {'username': f"bench{u}", 'email': email,
+                           'password': 'Bench-passw0rd', 'confirm_password': 'Bench-passw0rd'})
+        post('/login', {'email': email, 'password': 'Bench-passw0rd'})
+
+        body = ' '.join(rng.choice(words) for _ in range(3000)).encode()
+        boundary = 'bench-boundary'
+        payload = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="doc{u}.txt"\r\n'
+                   'Content-Type: text/plain\r\n\r\n').encode() + body + f'\r\n--{boundary}--\r\n'.encode()
+        opener.open(urllib.request.Request(base_url + '/upload', data=payload, headers={
+            'Content-Type': f'multipart/form-data; boundary={boundary}'})).read()
+        openers.append(opener)
+    for i in range(searches):
+        query = ' '.join(rng.choice(words) for _ in range(6))
+        openers[i % users].open(base_url + '/search', urllib.parse.urlencode(
+            {'query': query, 'document_id': 'all'}).encode()).read()
+
+def measure(mode, args, work_dir):
+    app_dir = os.path.join(work_dir, mode)
+    shutil.copytree(PROJECT_DIR, app_dir, ignore=shutil.ignore_patterns(
+        '.git', '__pycache__', 'uploads', 'faiss_indexes', 'instance', '*.sqlite3'))
+    config = os.path.join(app_dir, 'gunicorn.conf.py')
+    if mode == 'per_worker':
+        config = os.path.join(work_dir, 'per_worker.conf.py')
+        with open(config, 'w') as f:
+            f.write(PER_WORKER_CONFIG.format(config=os.path.join(app_dir, 'gunicorn.conf.py')))
+
+    env = dict(os.environ, DATABASE_URI=f"sqlite:///{os.path.join(app_dir, 'bench.sqlite3')}",
+               EMBEDDING_BACKEND=args.backend, GUNICORN_WORKERS=str(args.workers),
+               GUNICORN_BIND=f"127.0.0.1:{args.port}", LLM_PROVIDER='local',
+               METRICS_DIR=os.path.join(work_dir, f"{mode}-metrics"))
+    subprocess.run([sys.executable, '-c', 'from app import app, db\nwith app.app_context(): db.create_all()'],
+                   cwd=app_dir, env=env, check=True, capture_output=True)
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', config, 'app:app'], cwd=app_dir,
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + args.startup_timeout
+        while True:
+            if time.time() > deadline:
+                raise RuntimeError(f"gunicorn did not start within {args.startup_timeout}s")
+            time.sleep(1)
+            if len(worker_pids(server.pid)) == args.workers:
+                try:
+                    urllib.request.urlopen(base_url + '/login').read()
+                    break
+                except OSError:
+                    pass
+        time.sleep(3)
+        idle = snapshot(server.pid)
+        run_load(base_url, users=args.workers, searches=args.searches, seed=args.seed)
+        time.sleep(2)
+        return {'idle': idle, 'after_load': snapshot(server.pid)}
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--backend', default=os.getenv('EMBEDDING_BACKEND', 'sentence-transformers'))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--searches', type=int, default=60)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--startup-timeout', type=int, default=600)
+    parser.add_argument('--output', default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {'backend': args.backend, 'workers': args.workers, 'results': {}}
+    work_dir = tempfile.mkdtemp(prefix='askmydocs-mem-')
+    try:
+        for mode in ('per_worker', 'preload'):
+            print(f"🔄 Measuring {mode}...")
+            report['results'][mode] = result = measure(mode, args, work_dir)
+            print(f"✅ {mode}: worker USS {result['idle']['worker_avg']['uss']} MB idle, "
+                  f"{result['after_load']['worker_avg']['uss']} MB after load; "
+                  f"total PSS {result['after_load']['total_pss']} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        print(f"✅ Report written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Near-duplicate chunk detection with MinHash and locality-sensitive hashing.
+
+Every indexed chunk carries a MinHash signature of its word 3-grams in its
+metadata (``minhash``). A user's LSH index is built from those signatures:
+each signature is cut into bands, and two chunks that agree on all rows of
+any band become candidates, confirmed when the estimated Jaccard similarity
+of their signatures reaches the threshold. With 8 bands of 8 rows, pairs at
+0.9 similarity are found with > 99.9% probability while pairs below 0.5
+are rarely even compared.
+
+A near-duplicate of an indexed chunk is not embedded. It is linked to the
+canonical chunk instead: the canonical chunk's metadata lists it under
+``duplicates``. It stays findable through a document filter, and it takes
+over the canonical chunk's vector when the canonical document is deleted.
+"""
+import zlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+
+_PRIME = 4294967291  # largest prime below 2**32, so signatures fit in uint32
+_rng = np.random.RandomState(20240601)  # fixed seed: signatures are persisted
+_A = _rng.randint(1, _PRIME, size=(NUM_PERM, 1), dtype=np.uint64)
+_B = _rng.randint(0, _PRIME, size=(NUM_PERM, 1), dtype=np.uint64)
+_BAND_MIX = np.uint64(0x100000001B3)
+
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature (``NUM_PERM`` uint32 values) of the text's word 3-grams."""
+    words = text.lower().split()
+    shingles = {' '.join(words[i:i + SHINGLE_WORDS])
+                for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    return ((_A * hashes + _B) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def _band_hashes(signatures: np.ndarray) -> np.ndarray:
+    """One 64-bit hash per band of each signature, shape (n, BANDS)."""
+    bands = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    hashes = np.zeros((len(signatures), BANDS), dtype=np.uint64)
+    for row in range(ROWS):
+        hashes = (hashes ^ bands[:, :, row]) * _BAND_MIX  # FNV-style, wraps modulo 2**64
+    return hashes
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures, answering "which chunk is this a near-duplicate of?"."""
+
+    def __init__(self, signatures: np.ndarray, keys):
+        self.signatures = signatures
+        self.keys = list(keys)
+        hashes = _band_hashes(signatures)
+        self._order = np.argsort(hashes, axis=0, kind='stable')
+        self._sorted = np.take_along_axis(hashes, self._order, axis=0)
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        """Index the chunks of a user's metadata that carry a signature.
+
+        Keys are ``(document_id, chunk_index)``. Chunks indexed before
+        signatures were recorded are left out.
+        """
+        chunks = [chunk for chunk in metadata if chunk.get('minhash') is not None]
+        signatures = np.frombuffer(b''.join(chunk['minhash'] for chunk in chunks), dtype=np.uint32)
+        return cls(signatures.reshape(len(chunks), NUM_PERM),
+                   [(chunk['document_id'], chunk['chunk_index']) for chunk in chunks])
+
+    def find(self, signature: np.ndarray, threshold: float):
+        """Key of the most similar indexed chunk at ``threshold`` or above, else None."""
+        if not self.keys:
+            return None
+        query = _band_hashes(signature[None, :])[0]
+        candidates = []
+        for band in range(BANDS):
+            column = self._sorted[:, band]
+            start = np.searchsorted(column, query[band], side='left')
+            stop = np.searchsorted(column, query[band], side='right')
+            candidates.append(self._order[start:stop, band])
+        candidates = np.unique(np.concatenate(candidates))
+        if not len(candidates):
+            return None
+        similarity = (self.signatures[candidates] == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        return self.keys[candidates[best]] if similarity[best] >= threshold else None
+
+
+def find_duplicates(document_id: int, signatures, index: LSHIndex, threshold: float):
+    """Canonical chunk key for each new chunk of a document, or None if it is unique.
+
+    New chunks are compared with the indexed chunks and with the earlier
+    unique chunks of the same document.
+    """
+    canonical = []
+    unique_positions = []
+    for position, signature in enumerate(signatures):
+        match = index.find(signature, threshold)
+        if match is None and unique_positions:
+            similarity = (np.stack([signatures[p] for p in unique_positions]) == signature).mean(axis=1)
+            best = int(np.argmax(similarity))
+            if similarity[best] >= threshold:
+                match = (document_id, unique_positions[best])
+        if match is None:
+            unique_positions.append(position)
+        canonical.append(match)
+    return canonical
+
+
+def unlink_document(metadata, document_id: int):
+    """Drop a document's chunks and links from the metadata.
+
+    A removed chunk with duplicates in other documents is not dropped: its
+    first remaining duplicate takes its place (and its near-identical
+    vector). Returns ``(removed positions, new metadata)``, or None if the
+    document has no chunks or links.
+    """
+    removed = []
+    new_metadata = []
+    changed = False
+    for position, chunk in enumerate(metadata):
+        linked = chunk.get('duplicates') or []
+        duplicates = [d for d in linked if d['document_id'] != document_id]
+        if chunk['document_id'] == document_id:
+            changed = True
+            if not duplicates:
+                removed.append(position)
+                continue
+            # Promote the first linked duplicate from another document
+            chunk = dict(duplicates[0], minhash=chunk.get('minhash'))
+            duplicates = duplicates[1:]
+        elif len(duplicates) != len(linked):
+            changed = True
+            chunk = dict(chunk)
+        else:
+            new_metadata.append(chunk)
+            continue
+        chunk.pop('duplicates', None)
+        if duplicates:
+            chunk['duplicates'] = duplicates
+        new_metadata.append(chunk)
+    return (removed, new_metadata) if changed else None
+
+
+class LSHCache:
+    """Per-user LSH indexes, rebuilt when the user's cached metadata changes.
+
+    At most ``max_users`` users are kept, least recently used evicted first,
+    so the metadata they reference can be freed.
+    """
+
+    def __init__(self, max_users: int = 64):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (metadata, LSHIndex)
+
+    def get(self, user_id: int, metadata) -> LSHIndex:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            # The index store hands out the same metadata list until the index
+            # changes; holding a reference keeps its identity from being reused
+            if entry is not None and entry[0] is metadata:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+        index = LSHIndex.from_metadata(metadata)
+        with self._lock:
+            self._entries[user_id] = (metadata, index)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > max(self.max_users, 0):
+                self._entries.popitem(last=False)
+        return index
+
+    def invalidate(self, user_id: int):
+        """Drop a user's index (e.g. when the user is deleted)."""
+        with self._lock:
+            self._entries.pop(user_id, None)
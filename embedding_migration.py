@@ -0,0 +1,105 @@
+"""
+Online migration of per-user indexes to a new embedding model.
+
+Every index records the model that embedded it (see ``index_store``). When
+the configured model changes, new users start on it right away while
+existing indexes keep serving searches with their old model. Migration then
+re-embeds one user at a time from the chunk texts stored in the metadata:
+
+1. Embed a snapshot of the user's chunks with the new model, without holding
+   the user's lock, so uploads and searches continue meanwhile.
+2. Take the write lock, embed any chunks added since the snapshot, drop
+   vectors of chunks deleted since, and save the new index with its new tag.
+
+The swap is atomic: a search sees either the old index and model or the new
+ones, never a mix.
+"""
+import time
+
+import faiss
+import numpy as np
+
+
+def _chunk_key(chunk_metadata):
+    return chunk_metadata['document_id'], chunk_metadata['chunk_index'], chunk_metadata['text']
+
+
+def _embed(model, texts, batch_size):
+    if not texts:
+        return np.zeros((0, model.dimension), dtype='float32')
+    embeddings = model.encode(texts, batch_size=batch_size)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def needs_migration(store, user_id: int, model) -> bool:
+    """Whether the user's index was embedded with another model."""
+    return store.read_model_tag(user_id)[0] != model.model_id
+
+
+def migrate_user(store, user_id: int, model, batch_size: int = 64):
+    """Re-embed one user's index with ``model``.
+
+    Returns the number of chunks in the migrated index, or None if the index
+    was already on ``model``.
+    """
+    if not needs_migration(store, user_id, model):
+        return None
+
+    snapshot = store.read_metadata(user_id)
+    embedded = _embed(model, [chunk['text'] for chunk in snapshot], batch_size)
+    rows = {_chunk_key(chunk): row for row, chunk in enumerate(snapshot)}
+
+    with store.lock(user_id):
+        if not needs_migration(store, user_id, model):
+            return None  # another process finished first
+        metadata = store.read_metadata(user_id)
+
+        # Chunks uploaded while the snapshot was being embedded
+        added = [position for position, chunk in enumerate(metadata) if _chunk_key(chunk) not in rows]
+        added_embeddings = _embed(model, [metadata[position]['text'] for position in added], batch_size)
+
+        vectors = np.empty((len(metadata), model.dimension), dtype='float32')
+        for position, chunk in enumerate(metadata):
+            row = rows.get(_chunk_key(chunk))
+            if row is not None:
+                vectors[position] = embedded[row]
+        if added:
+            vectors[added] = added_embeddings
+
+        index = faiss.IndexFlatIP(model.dimension)
+        index.add(vectors)
+        store.save(user_id, index, metadata, model_id=model.model_id)
+    return len(metadata)
+
+
+def migrate_all(store, model, priority_user_ids=(), batch_size: int = 64,
+                pause_seconds: float = 0.0, log=print):
+    """Migrate every index on another model, ``priority_user_ids`` first.
+
+    ``pause_seconds`` between users leaves CPU for the serving workers.
+    Returns ``{'migrated': users, 'chunks': chunks, 'failed': users}``.
+    """
+    on_disk = set(store.user_ids())
+    ordered = [user_id for user_id in dict.fromkeys(priority_user_ids) if user_id in on_disk]
+    ordered += sorted(on_disk - set(ordered))
+
+    summary = {'migrated': 0, 'chunks': 0, 'failed': 0}
+    for user_id in ordered:
+        if not needs_migration(store, user_id, model):
+            continue
+        start = time.perf_counter()
+        try:
+            chunks = migrate_user(store, user_id, model, batch_size=batch_size)
+        except Exception as e:
+            summary['failed'] += 1
+            log(f"❌ User {user_id}: {e}")
+            continue
+        if chunks is None:
+            continue
+        summary['migrated'] += 1
+        summary['chunks'] += chunks
+        log(f"✅ User {user_id}: {chunks} chunks re-embedded in {time.perf_counter() - start:.1f}s")
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return summary
@@ -0,0 +1,194 @@
+"""
+Embedding backends for the RAG Flask application.
+
+Two interchangeable backends produce the same L2-normalized sentence
+embeddings for a model (all-MiniLM-L6-v2, 384-d, by default):
+
+- ``sentence-transformers``: the default PyTorch path.
+- ``onnx``: ONNX Runtime running an exported graph, optionally int8-quantized.
+  Create the graph once with ``python export_onnx_model.py``.
+
+Every backend exposes ``model_id`` and ``dimension``; indexes are tagged with
+both so vectors from different models are never mixed. The int8-quantized
+ONNX graph produces slightly different vectors than the float32 model, so it
+has its own id (``<model>@onnx-int8``); the float32 ONNX graph shares the
+PyTorch model's id.
+"""
+import os
+from typing import List
+
+import numpy as np
+
+DEFAULT_MODEL_NAME = 'all-MiniLM-L6-v2'
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_QUANTIZED_MODEL_FILE = 'model.int8.onnx'
+MAX_SEQ_LENGTH = 256  # Same truncation as the sentence-transformers config
+ONNX_INT8_SUFFIX = '@onnx-int8'
+
+
+def split_model_id(model_id: str):
+    """``(model_name, int8)`` for a model id, ``int8`` set for the quantized ONNX graph."""
+    if model_id.endswith(ONNX_INT8_SUFFIX):
+        return model_id[:-len(ONNX_INT8_SUFFIX)], True
+    return model_id, False
+
+
+class SentenceTransformerBackend:
+    """Embed text with the PyTorch sentence-transformers model."""
+
+    name = 'sentence-transformers'
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.model_id = model_name
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def after_fork(self, num_threads: int = 0):
+        """Size the per-worker torch thread pool; weights stay shared copy-on-write."""
+        import torch
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+
+class OnnxBackend:
+    """Embed text with an exported ONNX graph on ONNX Runtime (CPU)."""
+
+    name = 'onnx'
+
+    def __init__(self, model_dir: str, quantized: bool = True, num_threads: int = 0,
+                 model_id: str = None):
+        from transformers import AutoTokenizer
+
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"ONNX model not found at {model_path}. "
+                "Run: python export_onnx_model.py"
+            )
+
+        self.model_name = os.path.basename(os.path.normpath(model_dir))
+        self.model_id = (model_id or self.model_name) + (ONNX_INT8_SUFFIX if quantized else '')
+        self.model_path = model_path
+        self.quantized = quantized
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._create_session(num_threads)
+        self.dimension = self.encode(['dimension probe']).shape[1]
+
+    def _create_session(self, num_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def after_fork(self, num_threads: int = 0):
+        """Recreate the session in a forked worker.
+
+        ONNX Runtime thread pools do not survive fork(), so each worker needs
+        its own session, and with it its own copy of the weights and memory
+        arena: copy-on-write sharing does not apply to them. Only the
+        imports and the tokenizer stay shared.
+        """
+        self._create_session(num_threads)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            tokens = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors='np'
+            )
+            feed = {k: v.astype(np.int64) for k, v in tokens.items() if k in self.input_names}
+            token_embeddings = self.session.run(None, feed)[0]
+
+            # Mean pooling over non-padding tokens, then L2 normalize,
+            # mirroring the Pooling + Normalize modules of the original model
+            mask = tokens['attention_mask'][..., None].astype(np.float32)
+            summed = (token_embeddings * mask).sum(axis=1)
+            counts = np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled = summed / counts
+            norms = np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled / norms)
+
+        return np.ascontiguousarray(np.vstack(batches), dtype=np.float32)
+
+
+def load_embedding_model(backend: str = 'sentence-transformers',
+                         model_name: str = DEFAULT_MODEL_NAME,
+                         onnx_model_dir: str = None,
+                         onnx_quantized: bool = True,
+                         num_threads: int = 0):
+    """Create the embedding backend selected by configuration."""
+    backend = (backend or 'sentence-transformers').lower().strip()
+    if backend == 'onnx':
+        model_dir = onnx_model_dir or os.path.join('onnx_models', model_name)
+        return OnnxBackend(model_dir, quantized=onnx_quantized, num_threads=num_threads,
+                           model_id=model_name)
+    if backend in ('sentence-transformers', 'sentence_transformers', 'pytorch'):
+        return SentenceTransformerBackend(model_name)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Use 'sentence-transformers' or 'onnx'.")
+
+
+def export_onnx_model(model_name: str = DEFAULT_MODEL_NAME, output_dir: str = None,
+                      quantize: bool = True) -> str:
+    """Export the transformer of a sentence-transformers model to ONNX.
+
+    Writes ``model.onnx`` and the tokenizer files to ``output_dir`` and, when
+    ``quantize`` is set, a dynamically int8-quantized ``model.int8.onnx``.
+    Returns the output directory.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = output_dir or os.path.join('onnx_models', model_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(['Export sample sentence.'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            do_constant_folding=True
+        )
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(
+            model_path,
+            os.path.join(output_dir, ONNX_QUANTIZED_MODEL_FILE),
+            weight_type=QuantType.QInt8
+        )
+
+    return output_dir
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Export the embedding model to ONNX (and an int8-quantized copy) for the
+ONNX Runtime embedding backend (EMBEDDING_BACKEND=onnx)
+"""
+import os
+import sys
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+from embeddings import export_onnx_model, DEFAULT_MODEL_NAME
+
+def main():
+    """Export the configured embedding model."""
+    load_dotenv()
+    model_name = os.getenv('EMBEDDING_MODEL', DEFAULT_MODEL_NAME)
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    output_dir = os.getenv('ONNX_MODEL_DIR', os.path.join(base_dir, 'onnx_models', model_name))
+
+    print(f"🔄 Exporting {model_name} to {output_dir} ...")
+    try:
+        export_onnx_model(model_name, output_dir, quantize=True)
+    except Exception as e:
+        print(f"❌ Export failed: {e}")
+        sys.exit(1)
+
+    print("✅ Export complete")
+    print("   Set EMBEDDING_BACKEND=onnx in .env to use it")
+    print("   Set ONNX_QUANTIZED=false to use the float32 graph instead of int8")
+
+if __name__ == '__main__':
+    main()
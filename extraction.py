@@ -0,0 +1,255 @@
+"""
+Fast text extraction for uploaded documents.
+
+DOCX files are read by streaming ``word/document.xml`` straight out of the ZIP
+container with an incremental XML parser, instead of building the full
+python-docx object model. Paragraphs and table rows are emitted in document
+order, and every finished block is dropped from the tree so memory stays flat
+on large contracts.
+
+PDF text is extracted page by page and returned with its page numbers. Large
+PDFs are split into page ranges that a process pool extracts in parallel.
+Headers, footers and legal lines repeated at the top or bottom of most pages
+can then be stripped before chunking.
+"""
+import os
+import re
+import zipfile
+import threading
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC_NS = '{http://schemas.openxmlformats.org/markup-compatibility/2006}'
+_BODY = W_NS + 'body'
+_PARAGRAPH = W_NS + 'p'
+_TEXT = W_NS + 't'
+_TAB = W_NS + 'tab'
+_BREAKS = (W_NS + 'br', W_NS + 'cr')
+_TABLE = W_NS + 'tbl'
+_ROW = W_NS + 'tr'
+_CELL = W_NS + 'tc'
+_TEXT_BOX = W_NS + 'txbxContent'
+_FALLBACK = MC_NS + 'Fallback'
+
+TABLE_CELL_SEPARATOR = ' | '
+
+
+def iter_docx_blocks(file_path: str):
+    """Yield the text of each paragraph and table row of a DOCX, in order.
+
+    Table rows are yielded as their cell texts joined by ``TABLE_CELL_SEPARATOR``;
+    paragraphs inside a cell are joined by spaces. Nested tables become part
+    of the enclosing cell. Text boxes are yielded after the paragraph they are
+    anchored in, once: ``mc:Fallback`` copies of the same content are skipped.
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as xml_file:
+        body = None
+        depth = 0
+        skipping = 0     # depth of open mc:Fallback elements
+        paragraphs = []  # stack of open paragraphs: {'parts': [...], 'boxes': [...]}
+        tables = []      # stack of open tables: {'rows': [...], 'row': [...], 'cell': [...]}
+        text_boxes = []  # stack of open text boxes: {'blocks': [...], 'tables': enclosing tables}
+
+        def place(blocks):
+            """Put finished blocks in the open cell or text box; return the rest."""
+            if tables:
+                tables[-1]['cell'].extend(block.strip() for block in blocks if block.strip())
+            elif text_boxes:
+                text_boxes[-1]['blocks'].extend(blocks)
+            else:
+                return blocks
+            return []
+
+        for event, element in ET.iterparse(xml_file, events=('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                depth += 1
+                if skipping or tag == _FALLBACK:
+                    skipping += tag == _FALLBACK
+                elif tag == _PARAGRAPH:
+                    paragraphs.append({'parts': [], 'boxes': []})
+                elif tag == _TABLE:
+                    tables.append({'rows': [], 'row': [], 'cell': []})
+                elif tag == _ROW and tables:
+                    tables[-1]['row'] = []
+                elif tag == _CELL and tables:
+                    tables[-1]['cell'] = []
+                elif tag == _TEXT_BOX:
+                    # Tables inside the box are its own, not the enclosing cell's
+                    text_boxes.append({'blocks': [], 'tables': tables})
+                    tables = []
+                elif tag == _BODY:
+                    body = element
+                continue
+
+            depth -= 1
+            if skipping:
+                skipping -= tag == _FALLBACK
+                continue
+            if tag == _TEXT:
+                if paragraphs and element.text:
+                    paragraphs[-1]['parts'].append(element.text)
+            elif tag == _TAB:
+                if paragraphs:
+                    paragraphs[-1]['parts'].append('\t')
+            elif tag in _BREAKS:
+                if paragraphs:
+                    paragraphs[-1]['parts'].append('\n')
+            elif tag == _PARAGRAPH:
+                paragraph = paragraphs.pop()
+                yield from place([''.join(paragraph['parts'])] + paragraph['boxes'])
+            elif tag == _TEXT_BOX:
+                text_box = text_boxes.pop()
+                tables = text_box['tables']
+                if paragraphs:
+                    paragraphs[-1]['boxes'].extend(text_box['blocks'])
+                else:
+                    yield from place(text_box['blocks'])
+            elif tag == _CELL and tables:
+                tables[-1]['row'].append(' '.join(tables[-1]['cell']))
+            elif tag == _ROW and tables:
+                row = tables[-1]['row']
+                if any(row):
+                    tables[-1]['rows'].append(TABLE_CELL_SEPARATOR.join(row))
+            elif tag == _TABLE:
+                rows = tables.pop()['rows']
+                if tables:
+                    tables[-1]['cell'].extend(rows)
+                else:
+                    yield from place(rows)
+
+            # Drop finished top-level blocks (depth 2 is the body's children)
+            if depth == 2 and body is not None:
+                element.clear()
+                body.remove(element)
+
+
+def extract_docx_text(file_path: str) -> str:
+    """Text of a DOCX file, including tables, one paragraph or table row per line."""
+    return ''.join(block + '\n' for block in iter_docx_blocks(file_path))
+
+
+def _extract_pdf_range(file_path: str, start: int, stop: int):
+    """(page number, text) for pages ``start``..``stop - 1`` (0-based) of a PDF."""
+    with fitz.open(file_path) as doc:
+        return [(number + 1, doc[number].get_text()) for number in range(start, stop)]
+
+
+# One extraction pool per server process, created on first use and reused.
+# Its workers are started by a fork server (or spawned), never forked from
+# the threaded server process with its model and inference thread pools.
+# Like any spawned process they import the main module first: cheap under
+# gunicorn and run.py, whose top level does not load the app. Under
+# ``python app.py`` the app passes ``workers=1`` so no pool is started.
+_pool = {'pid': None, 'workers': 0, 'executor': None}
+_pool_lock = threading.Lock()
+
+
+def _extraction_pool(workers: int) -> ProcessPoolExecutor:
+    with _pool_lock:
+        if _pool['pid'] != os.getpid() or _pool['workers'] != workers or _pool['executor'] is None:
+            if _pool['pid'] == os.getpid() and _pool['executor'] is not None:
+                _pool['executor'].shutdown(wait=False)
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool.update(pid=os.getpid(), workers=workers,
+                         executor=ProcessPoolExecutor(max_workers=workers,
+                                                      mp_context=multiprocessing.get_context(method)))
+        return _pool['executor']
+
+
+def _discard_pool(executor: ProcessPoolExecutor):
+    with _pool_lock:
+        if _pool['executor'] is executor:
+            _pool['executor'] = None
+    executor.shutdown(wait=False)
+
+
+def extract_pdf_pages(file_path: str, parallel_min_pages: int = 100, workers: int = None):
+    """Text of each PDF page as a list of ``(page_number, text)``, in page order.
+
+    PDFs with at least ``parallel_min_pages`` pages are split into page ranges
+    extracted by the process's pool of ``workers`` processes (default: one
+    per CPU). ``parallel_min_pages <= 0`` or fewer than two workers always
+    extracts in this process, as does a pool whose workers died.
+    """
+    with fitz.open(file_path) as doc:
+        page_count = doc.page_count
+    workers = workers or os.cpu_count() or 1
+    if parallel_min_pages <= 0 or page_count < parallel_min_pages or workers < 2:
+        return _extract_pdf_range(file_path, 0, page_count)
+
+    # A few ranges per worker, so one slow range does not hold up the rest
+    range_size = max(1, -(-page_count // (workers * 4)))
+    starts = range(0, page_count, range_size)
+    stops = [min(start + range_size, page_count) for start in starts]
+    pool = _extraction_pool(workers)
+    try:
+        ranges = pool.map(_extract_pdf_range, [file_path] * len(starts), starts, stops)
+        return [page for pages in ranges for page in pages]
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        return _extract_pdf_range(file_path, 0, page_count)
+
+
+def _boilerplate_key(line: str) -> str:
+    """Normalized line: page numbers and dates vary between pages, so digits are masked."""
+    return re.sub(r'\d+', '#', ' '.join(line.split())).lower()
+
+
+def strip_repeated_lines(pages, min_share: float = 0.5, edge_lines: int = 3, min_pages: int = 3):
+    """Remove header and footer lines repeated across the pages of a document.
+
+    A line counts as boilerplate when it is among the first or last
+    ``edge_lines`` non-blank lines of at least ``min_share`` of the pages
+    (and of two pages at least), comparing lines with digits masked so
+    "Page 3" matches "Page 4". Each zone covers at most half of a page's
+    non-blank lines, so the zones never overlap and lines in the middle of
+    a page are kept.
+
+    ``pages`` is a list of ``(page_number, text)``. Returns the cleaned pages
+    and the number of lines removed; documents with fewer than ``min_pages``
+    pages, or ``min_share <= 0``, are returned unchanged. A page that would
+    lose all of its lines is kept as it is, and a document that would lose
+    all of its text is returned unchanged.
+    """
+    if min_share <= 0 or len(pages) < min_pages:
+        return pages, 0
+
+    def edges(lines):
+        """Positions of the top and bottom lines of a page, tagged with their zone."""
+        filled = [position for position, line in enumerate(lines) if line.strip()]
+        zone = min(edge_lines, len(filled) // 2)
+        if not zone:
+            return []
+        return ([('top', position) for position in filled[:zone]] +
+                [('bottom', position) for position in filled[-zone:]])
+
+    page_lines = [text.splitlines() for _, text in pages]
+    page_counts = {}
+    for lines in page_lines:
+        for key in {(zone, _boilerplate_key(lines[position])) for zone, position in edges(lines)}:
+            page_counts[key] = page_counts.get(key, 0) + 1
+
+    threshold = max(2, min_share * sum(1 for lines in page_lines if any(line.strip() for line in lines)))
+    repeated = {key for key, count in page_counts.items() if count >= threshold}
+    if not repeated:
+        return pages, 0
+
+    cleaned = []
+    removed = 0
+    for (page_number, text), lines in zip(pages, page_lines):
+        drop = {position for zone, position in edges(lines)
+                if (zone, _boilerplate_key(lines[position])) in repeated}
+        kept = [line for position, line in enumerate(lines) if position not in drop]
+        if drop and any(line.strip() for line in kept):
+            removed += len(drop)
+            text = '\n'.join(kept) + '\n'
+        cleaned.append((page_number, text))
+    if not any(text.strip() for _, text in cleaned):
+        return pages, 0
+    return cleaned, removed
@@ -0,0 +1,67 @@
+"""
+Gunicorn configuration for serving the RAG Flask application with several workers
+
+The app, and with it the embedding model, is imported once in the master
+process before the workers are forked (preload_app). Workers then share the
+model weights copy-on-write instead of each loading its own copy. With the
+ONNX backend each worker still builds its own InferenceSession after fork
+(see OnnxBackend.after_fork), so only the imports and tokenizer are shared.
+
+Workers are threaded (gthread), so concurrent uploads of one user that land
+in the same worker are group-committed by its IndexWriter into one index
+save; across workers they are serialized by the per-user file lock.
+
+Metrics of all workers are aggregated through snapshot files in
+METRICS_DIR, so every /metrics scrape reports the whole server.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+import gc
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+# Set before the app is preloaded: metrics.py reads it at import
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'askmydocs-metrics'))
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = True
+
+# Split the cores between the workers so N torch/ONNX thread pools
+# do not oversubscribe the CPU
+embedding_threads = int(os.getenv('EMBEDDING_THREADS', '0')) or max(1, multiprocessing.cpu_count() // workers)
+
+def on_starting(server):
+    """Start every server run with fresh counters."""
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+
+def when_ready(server):
+    """Initialize the database, then freeze everything allocated while importing the app.
+
+    Objects moved to the permanent generation are never scanned by the
+    cyclic GC in the workers, so the GC does not write to (and un-share)
+    the pages holding the model and its Python wrappers.
+    """
+    from app import app, db, create_directories
+    create_directories()
+    with app.app_context():
+        db.create_all()
+        # Do not hand pooled SQLite connections to the forked workers
+        db.engine.dispose()
+
+    gc.freeze()
+    server.log.info("Embedding model preloaded; %s objects frozen for copy-on-write sharing",
+                    gc.get_freeze_count())
+
+def post_fork(server, worker):
+    """Give each worker its own inference thread pool over the shared weights."""
+    from app import embedding_model
+    embedding_model.after_fork(embedding_threads)
+    server.log.info("Worker %s using %s embedding threads", worker.pid, embedding_threads)
@@ -0,0 +1,583 @@
+"""
+Per-user FAISS index storage that is safe to share between worker processes.
+
+Each user directory under the FAISS folder holds:
+
+- ``index.faiss`` / ``metadata.npy``: the index and its chunk metadata
+- ``model.json``: the embedding model id and dimension of the vectors
+- ``generation``: a counter bumped on every write
+- ``index.lock``: the lock file guarding writes
+- ``vectors.f32`` / ``coarse.faiss``: only with two-stage search enabled, a
+  raw float32 copy of the vectors and a compressed coarse index built from it
+
+Writers take an exclusive ``flock`` on the lock file, replace the data files
+atomically and then bump the generation. Each process keeps the last index it
+loaded per user and reuses it until the generation file changes, so a write
+in one worker invalidates the in-memory copy in every other worker. Only the
+``max_cached_users`` most recently used users are kept; older entries are
+evicted in LRU order.
+
+Indexes at least ``mmap_min_bytes`` large are memory-mapped read-only for
+searching instead of copied onto the heap: the OS page cache is shared by
+all workers and a cold search only touches the pages it reads. Writers
+always read a private heap copy, which is not kept once saved.
+
+Two-stage search keeps only the coarse index (SQ8: 1 byte per dimension, or
+binary: 1 bit per dimension) in memory and re-scores its candidates with
+exact vectors read through a memory map of ``vectors.f32``.
+"""
+import os
+import json
+import shutil
+import struct
+import weakref
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: the dev server is single-process anyway
+    fcntl = None
+
+INDEX_FILE = 'index.faiss'
+METADATA_FILE = 'metadata.npy'
+GENERATION_FILE = 'generation'
+LOCK_FILE = 'index.lock'
+MODEL_FILE = 'model.json'
+VECTORS_FILE = 'vectors.f32'
+COARSE_FILE = 'coarse.faiss'
+COARSE_TYPES = ('sq8', 'binary')
+
+# Model of indexes written before they were tagged
+LEGACY_MODEL_ID = 'all-MiniLM-L6-v2'
+LEGACY_DIMENSION = 384
+
+# Serialized IndexFlat: fourcc, d (int32), ntotal (int64), two unused int64,
+# is_trained (bool), metric (int32), then the float count (uint64) and data
+FLAT_FOURCCS = {b'IxFI': faiss.METRIC_INNER_PRODUCT, b'IxF2': faiss.METRIC_L2}
+FLAT_HEADER = struct.Struct('<4siqqq?iQ')
+
+
+class MappedFlatIndex:
+    """Read-only flat index whose vectors are a memory map of an index file.
+
+    Used when FAISS cannot map flat indexes itself (``IO_FLAG_MMAP_IFC`` is
+    missing before FAISS 1.8). Supports the calls search needs.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            header = f.read(FLAT_HEADER.size)
+        fourcc, d, ntotal, _, _, _, metric, count = FLAT_HEADER.unpack(header)
+        if fourcc not in FLAT_FOURCCS or metric != FLAT_FOURCCS[fourcc] or count != ntotal * d:
+            raise ValueError(f"{path} is not a flat index that can be memory-mapped")
+        self.d = d
+        self.ntotal = ntotal
+        self.metric_type = metric
+        self.vectors = np.memmap(path, dtype='float32', mode='r', offset=FLAT_HEADER.size,
+                                 shape=(ntotal, d))
+
+    def search(self, x, k):
+        return faiss.knn(np.ascontiguousarray(x, dtype='float32'), self.vectors, k,
+                         metric=self.metric_type)
+
+    def reconstruct_batch(self, positions):
+        return np.asarray(self.vectors[positions])
+
+    def reconstruct_n(self, start, n):
+        return np.array(self.vectors[start:start + n])
+
+
+def read_index_mmap(path: str):
+    """Open an index file for read-only searching without copying it onto the heap."""
+    if hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    return MappedFlatIndex(path)
+
+
+def build_coarse_index(vectors: np.ndarray, coarse_type: str):
+    """Build a compressed index over ``vectors`` for candidate generation."""
+    dimension = vectors.shape[1]
+    if coarse_type == 'sq8':
+        coarse = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit,
+                                            faiss.METRIC_INNER_PRODUCT)
+        if len(vectors):
+            coarse.train(vectors)
+            coarse.add(vectors)
+        return coarse
+    if coarse_type == 'binary':
+        coarse = faiss.IndexBinaryFlat(dimension)
+        coarse.add(np.packbits(vectors > 0, axis=1))
+        return coarse
+    raise ValueError(f"Unknown coarse index type: {coarse_type!r} (expected one of {COARSE_TYPES})")
+
+
+def coarse_search(coarse, queries: np.ndarray, n: int):
+    """Candidate positions for each query from a coarse index, best first."""
+    if isinstance(coarse, faiss.IndexBinary):
+        _, candidates = coarse.search(np.packbits(queries > 0, axis=1), n)
+    else:
+        _, candidates = coarse.search(queries, n)
+    return candidates
+
+
+class UserIndexStore:
+    """Load, cache and atomically save per-user FAISS indexes."""
+
+    def __init__(self, root: str, dimension: int = LEGACY_DIMENSION, model_id: str = LEGACY_MODEL_ID,
+                 coarse_type: str = None, mmap_min_bytes: int = None, max_cached_users: int = 64):
+        if coarse_type is not None and coarse_type not in COARSE_TYPES:
+            raise ValueError(f"Unknown coarse index type: {coarse_type!r} (expected one of {COARSE_TYPES})")
+        self.root = root
+        self.dimension = dimension  # model of new indexes
+        self.model_id = model_id
+        self.coarse_type = coarse_type  # None disables the two-stage files
+        self.mmap_min_bytes = mmap_min_bytes  # None disables memory-mapped loads
+        self.max_cached_users = max_cached_users  # users kept across the caches below
+        self._cache = {}  # user_id -> (version, index, metadata, model tag)
+        self._two_stage_cache = {}  # user_id -> (version, coarse, vectors, metadata, model tag)
+        self._metadata_cache = {}  # user_id -> (version, metadata, model tag)
+        self._recent = OrderedDict()  # user_id -> None, least recently used first
+        self._cache_lock = threading.Lock()
+        # Only users with a thread inside lock() keep theirs
+        self._thread_locks = weakref.WeakValueDictionary()
+
+    def user_dir(self, user_id: int) -> str:
+        user_dir = os.path.join(self.root, str(user_id))
+        os.makedirs(user_dir, exist_ok=True)
+        return user_dir
+
+    def index_path(self, user_id: int) -> str:
+        return os.path.join(self.user_dir(user_id), INDEX_FILE)
+
+    def metadata_path(self, user_id: int) -> str:
+        return os.path.join(self.user_dir(user_id), METADATA_FILE)
+
+    def _thread_lock(self, user_id: int) -> threading.RLock:
+        with self._cache_lock:
+            thread_lock = self._thread_locks.get(user_id)
+            if thread_lock is None:
+                thread_lock = self._thread_locks[user_id] = threading.RLock()
+            return thread_lock
+
+    def _touch(self, user_id: int):
+        """Mark a user as most recently used and evict the least recently used.
+
+        Must be called while holding ``_cache_lock``.
+        """
+        self._recent[user_id] = None
+        self._recent.move_to_end(user_id)
+        while len(self._recent) > max(self.max_cached_users, 0):
+            evicted, _ = self._recent.popitem(last=False)
+            self._cache.pop(evicted, None)
+            self._two_stage_cache.pop(evicted, None)
+            self._metadata_cache.pop(evicted, None)
+            metrics.inc('index_cache_evict')
+
+    @contextmanager
+    def lock(self, user_id: int, shared: bool = False):
+        """Hold the user's index lock (exclusive for writers, shared for readers)."""
+        thread_lock = None if shared else self._thread_lock(user_id)
+        if thread_lock:
+            thread_lock.acquire()
+        try:
+            if fcntl is None:
+                yield
+                return
+            lock_path = os.path.join(self.user_dir(user_id), LOCK_FILE)
+            with open(lock_path, 'a+') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            if thread_lock:
+                thread_lock.release()
+
+    def version(self, user_id: int):
+        """Cheap change detector: one stat() of the generation file.
+
+        The generation file is replaced on every write, so (inode, mtime)
+        changes even if a deleted user's id is reused with the same counter.
+        """
+        try:
+            st = os.stat(os.path.join(self.root, str(user_id), GENERATION_FILE))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def generation(self, user_id: int) -> int:
+        """Current write generation of a user's index (0 if never written)."""
+        try:
+            with open(os.path.join(self.root, str(user_id), GENERATION_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def user_ids(self):
+        """Ids of all users that have an index on disk."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(name) for name in os.listdir(self.root)
+                      if name.isdigit() and os.path.exists(os.path.join(self.root, name, INDEX_FILE)))
+
+    def read_model_tag(self, user_id: int):
+        """``(model_id, dimension)`` of the vectors in a user's index.
+
+        Users without an index get the store's current model; indexes from
+        before model tags are assumed to hold the legacy model.
+        """
+        user_dir = os.path.join(self.root, str(user_id))
+        try:
+            with open(os.path.join(user_dir, MODEL_FILE)) as f:
+                tag = json.load(f)
+            return tag['model_id'], int(tag['dimension'])
+        except FileNotFoundError:
+            pass
+        if os.path.exists(os.path.join(user_dir, INDEX_FILE)):
+            return LEGACY_MODEL_ID, LEGACY_DIMENSION
+        return self.model_id, self.dimension
+
+    def read_metadata(self, user_id: int):
+        """Chunk metadata of a user's index without loading the vectors."""
+        metadata_path = os.path.join(self.root, str(user_id), METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            return []
+        return np.load(metadata_path, allow_pickle=True).tolist()
+
+    def load_metadata(self, user_id: int):
+        """Return the user's chunk metadata, reusing a cached copy if still current.
+
+        Never loads the vectors, so writers and two-stage workers can look
+        at the metadata without bringing the full index onto the heap. The
+        same list is returned until the index changes; treat it as read-only.
+        """
+        version = self.version(user_id)
+        with self._cache_lock:
+            for cache in (self._cache, self._metadata_cache, self._two_stage_cache):
+                cached = cache.get(user_id)
+                if cached and cached[0] == version:
+                    self._touch(user_id)
+                    return cached[-2]
+
+        with self.lock(user_id, shared=True):
+            version = self.version(user_id)
+            metadata = self.read_metadata(user_id)
+            tag = self.read_model_tag(user_id)
+        with self._cache_lock:
+            self._metadata_cache[user_id] = (version, metadata, tag)
+            self._touch(user_id)
+        return metadata
+
+    def read(self, user_id: int):
+        """Read the index from disk, bypassing the cache.
+
+        Writers call this while holding the exclusive lock so that they
+        mutate a private copy, never the snapshot other threads are reading.
+        """
+        faiss_path = self.index_path(user_id)
+        metadata_path = self.metadata_path(user_id)
+
+        if os.path.exists(faiss_path) and os.path.exists(metadata_path):
+            index = faiss.read_index(faiss_path)
+            metadata = np.load(metadata_path, allow_pickle=True).tolist()
+            return index, metadata
+        return faiss.IndexFlatIP(self.dimension), []
+
+    def load(self, user_id: int):
+        """Return the user's index, reusing the cached copy if still current.
+
+        The returned index and metadata are shared between threads and must
+        be treated as read-only.
+        """
+        index, metadata, _ = self.load_tagged(user_id)
+        return index, metadata
+
+    def load_tagged(self, user_id: int):
+        """Like ``load``, plus the ``(model_id, dimension)`` tag read with the same snapshot."""
+        version = self.version(user_id)
+        with self._cache_lock:
+            cached = self._cache.get(user_id)
+            if cached and cached[0] == version:
+                self._touch(user_id)
+        if cached and cached[0] == version:
+            metrics.inc('index_cache_hit')
+            return cached[1:]
+        metrics.inc('index_cache_miss')
+
+        with self.lock(user_id, shared=True):
+            version = self.version(user_id)
+            index, metadata = self._read_for_search(user_id)
+            tag = self.read_model_tag(user_id)
+        with self._cache_lock:
+            self._cache[user_id] = (version, index, metadata, tag)
+            self._touch(user_id)
+        return index, metadata, tag
+
+    def _read_for_search(self, user_id: int):
+        """Like ``read``, but memory-maps indexes above the size threshold."""
+        faiss_path = self.index_path(user_id)
+        metadata_path = self.metadata_path(user_id)
+        if (self.mmap_min_bytes is not None and os.path.exists(faiss_path)
+                and os.path.exists(metadata_path)
+                and os.path.getsize(faiss_path) >= max(self.mmap_min_bytes, FLAT_HEADER.size + 1)):
+            try:
+                index = read_index_mmap(faiss_path)
+            except (ValueError, RuntimeError):
+                index = None  # not a mappable index type: load it onto the heap
+            if index is not None:
+                metrics.inc('index_mmap_load')
+                metadata = np.load(metadata_path, allow_pickle=True).tolist()
+                return index, metadata
+        return self.read(user_id)
+
+    def save(self, user_id: int, index, metadata, model_id: str = None) -> int:
+        """Atomically write the index and bump the generation.
+
+        The index keeps its model tag unless ``model_id`` is given (as when
+        it was re-embedded with another model). Must be called while holding
+        ``lock(user_id)``. Returns the new generation.
+        """
+        faiss_path = self.index_path(user_id)
+        metadata_path = self.metadata_path(user_id)
+        generation_path = os.path.join(self.user_dir(user_id), GENERATION_FILE)
+        model_path = os.path.join(self.user_dir(user_id), MODEL_FILE)
+        if model_id is None:
+            model_id, dimension = self.read_model_tag(user_id)
+            if dimension != index.d:
+                raise ValueError(f"Index dimension {index.d} does not match model {model_id} ({dimension})")
+        tag = (model_id, index.d)
+
+        with metrics.timed('index_write'):
+            faiss.write_index(index, faiss_path + '.tmp')
+            with open(metadata_path + '.tmp', 'wb') as f:
+                np.save(f, np.array(metadata, dtype=object), allow_pickle=True)
+            if self.coarse_type:
+                self._write_two_stage_files(user_id, index)
+            with open(model_path + '.tmp', 'w') as f:
+                json.dump({'model_id': tag[0], 'dimension': tag[1]}, f)
+            os.replace(faiss_path + '.tmp', faiss_path)
+            os.replace(metadata_path + '.tmp', metadata_path)
+            os.replace(model_path + '.tmp', model_path)
+
+        generation = self.generation(user_id) + 1
+        with open(generation_path + '.tmp', 'w') as f:
+            f.write(str(generation))
+        os.replace(generation_path + '.tmp', generation_path)
+
+        # Two-stage search keeps only the coarse index in memory, and large
+        # indexes are memory-mapped by the next search: in both cases do not
+        # hold on to the writer's heap copy of the full index
+        keep_index = not self.coarse_type and (
+            self.mmap_min_bytes is None or os.path.getsize(faiss_path) < self.mmap_min_bytes)
+        with self._cache_lock:
+            if keep_index:
+                self._cache[user_id] = (self.version(user_id), index, metadata, tag)
+            else:
+                self._cache.pop(user_id, None)
+                self._metadata_cache[user_id] = (self.version(user_id), metadata, tag)
+            self._touch(user_id)
+        return generation
+
+    def _write_two_stage_files(self, user_id: int, index):
+        """Write the exact vector file and the coarse index derived from ``index``."""
+        vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else \
+            np.zeros((0, index.d), dtype='float32')
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        vectors_path = os.path.join(self.user_dir(user_id), VECTORS_FILE)
+        coarse_path = os.path.join(self.user_dir(user_id), COARSE_FILE)
+        vectors.tofile(vectors_path + '.tmp')
+        coarse = build_coarse_index(vectors, self.coarse_type)
+        if isinstance(coarse, faiss.IndexBinary):
+            faiss.write_index_binary(coarse, coarse_path + '.tmp')
+        else:
+            faiss.write_index(coarse, coarse_path + '.tmp')
+        os.replace(vectors_path + '.tmp', vectors_path)
+        os.replace(coarse_path + '.tmp', coarse_path)
+
+    def _read_two_stage(self, user_id: int):
+        user_dir = os.path.join(self.root, str(user_id))
+        coarse_path = os.path.join(user_dir, COARSE_FILE)
+        vectors_path = os.path.join(user_dir, VECTORS_FILE)
+        if self.coarse_type == 'binary':
+            coarse = faiss.read_index_binary(coarse_path)
+        else:
+            coarse = faiss.read_index(coarse_path)
+        if coarse.ntotal:
+            vectors = np.memmap(vectors_path, dtype='float32', mode='r',
+                                shape=(coarse.ntotal, coarse.d))
+        else:
+            vectors = np.zeros((0, coarse.d), dtype='float32')
+        metadata = np.load(os.path.join(user_dir, METADATA_FILE), allow_pickle=True).tolist()
+        return coarse, vectors, metadata, self.read_model_tag(user_id)
+
+    def _two_stage_current(self, user_id: int) -> bool:
+        """Whether the two-stage files exist, are up to date and match the coarse type."""
+        user_dir = os.path.join(self.root, str(user_id))
+        coarse_path = os.path.join(user_dir, COARSE_FILE)
+        index_path = os.path.join(user_dir, INDEX_FILE)
+        if not (os.path.exists(coarse_path) and os.path.exists(os.path.join(user_dir, VECTORS_FILE))):
+            return False
+        # Written after index.faiss by every save while enabled; an older file
+        # means the index was saved with two-stage search switched off
+        if os.path.exists(index_path) and os.stat(coarse_path).st_mtime_ns < os.stat(index_path).st_mtime_ns:
+            return False
+        with open(coarse_path, 'rb') as f:
+            is_binary = f.read(4).startswith(b'IB')
+        return is_binary == (self.coarse_type == 'binary')
+
+    def load_two_stage(self, user_id: int):
+        """Return ``(coarse_index, vectors, metadata, model_tag)`` for two-stage search.
+
+        ``vectors`` is a read-only memory map of the exact float32 vectors,
+        row-aligned with the coarse index and metadata. Indexes saved before
+        two-stage search was enabled get their files built on first use.
+        Returns ``(None, None, [], model_tag)`` for a user without an index.
+        """
+        if not self.coarse_type:
+            raise RuntimeError("Two-stage search needs a store created with a coarse_type")
+        version = self.version(user_id)
+        with self._cache_lock:
+            cached = self._two_stage_cache.get(user_id)
+            if cached and cached[0] == version:
+                self._touch(user_id)
+        if cached and cached[0] == version:
+            metrics.inc('index_cache_hit')
+            return cached[1:]
+        metrics.inc('index_cache_miss')
+        if version is None:
+            return None, None, [], self.read_model_tag(user_id)
+
+        if not self._two_stage_current(user_id):
+            with self.lock(user_id):
+                if not self._two_stage_current(user_id):
+                    index, _ = self.read(user_id)
+                    self._write_two_stage_files(user_id, index)
+
+        with self.lock(user_id, shared=True):
+            version = self.version(user_id)
+            loaded = self._read_two_stage(user_id)
+        with self._cache_lock:
+            self._two_stage_cache[user_id] = (version,) + loaded
+            self._touch(user_id)
+        return loaded
+
+    def cache_stats(self):
+        """Number of cached user indexes and the vectors they hold."""
+        with self._cache_lock:
+            entries = list(self._cache.values()) + list(self._two_stage_cache.values())
+        return len(entries), sum(entry[1].ntotal for entry in entries)
+
+    def invalidate(self, user_id: int):
+        """Drop the cached copy of a user's index in this process."""
+        with self._cache_lock:
+            self._cache.pop(user_id, None)
+            self._two_stage_cache.pop(user_id, None)
+            self._metadata_cache.pop(user_id, None)
+            self._recent.pop(user_id, None)
+
+    def remove(self, user_id: int):
+        """Delete all index files of a user (e.g. when the user is deleted)."""
+        user_dir = os.path.join(self.root, str(user_id))
+        if os.path.exists(user_dir):
+            with self.lock(user_id):
+                shutil.rmtree(user_dir)
+        self.invalidate(user_id)
+
+
+class _PendingMutation:
+    """A queued index mutation and the outcome reported back to its caller."""
+
+    def __init__(self, mutate):
+        self.mutate = mutate
+        self.done = threading.Event()
+        self.error = None
+
+
+class IndexWriter:
+    """Serialize all index mutations of a user and group-commit them.
+
+    Callers submit a ``mutate(index, metadata)`` function that returns the
+    updated ``(index, metadata)`` or ``None`` when nothing changed. The first
+    thread to arrive for a user becomes the writer: it takes the user's lock,
+    reads the index once, applies every mutation queued so far (including
+    ones that arrive while it works), saves once and wakes the other callers.
+    Parallel uploads therefore never overwrite each other and share a single
+    index write. Expensive work such as embedding happens before submitting,
+    outside the lock.
+
+    A mutation that raises may have changed the index or metadata halfway,
+    so its caller gets the error and the rest of the batch is applied again
+    to a fresh copy read from disk. Mutations must therefore only change
+    the index and metadata they are given.
+    """
+
+    def __init__(self, store: UserIndexStore):
+        self.store = store
+        self._mutex = threading.Lock()
+        self._pending = {}  # user_id -> [_PendingMutation]
+        self._writing = set()
+
+    def submit(self, user_id: int, mutate):
+        """Apply ``mutate`` to the user's index; blocks until it is saved."""
+        pending = _PendingMutation(mutate)
+        with self._mutex:
+            self._pending.setdefault(user_id, []).append(pending)
+            is_writer = user_id not in self._writing
+            if is_writer:
+                self._writing.add(user_id)
+
+        if is_writer:
+            self._drain(user_id)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+    def _drain(self, user_id: int):
+        while True:
+            with self._mutex:
+                batch = self._pending.pop(user_id, [])
+                if not batch:
+                    self._writing.discard(user_id)
+                    return
+            self._commit(user_id, batch)
+
+    def _commit(self, user_id: int, batch):
+        try:
+            with self.store.lock(user_id):
+                while True:
+                    index, metadata = self.store.read(user_id)
+                    changed = False
+                    for pending in batch:
+                        if pending.error is not None:
+                            continue
+                        try:
+                            updated = pending.mutate(index, metadata)
+                        except Exception as e:
+                            pending.error = e
+                            break
+                        if updated is not None:
+                            index, metadata = updated
+                            changed = True
+                    else:
+                        break
+                    # Start over without the failed mutation
+                    metrics.inc('index_mutation_failed')
+                if changed:
+                    self.store.save(user_id, index, metadata)
+                    metrics.inc('index_group_commit')
+                    metrics.inc('index_mutation', sum(pending.error is None for pending in batch))
+        except Exception as e:
+            for pending in batch:
+                if pending.error is None:
+                    pending.error = e
+        finally:
+            for pending in batch:
+                pending.done.set()
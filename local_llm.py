@@ -0,0 +1,85 @@
+"""
+Deterministic local LLM provider (``LLM_PROVIDER=local``).
+
+Answers are extractive: the context sentences that share the most words with
+the question are quoted with their sources, so the same question and context
+always produce the same answer, without network access or API keys. A delay
+before the first token (``latency_ms``) and between tokens (``token_ms``)
+stands in for a hosted model, so the whole RAG path can be load-tested and
+benchmarked offline with realistic timings.
+"""
+import re
+import time
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_WORD = re.compile(r'\w+')
+_TOKEN = re.compile(r'\s*\S+')
+
+STOP_WORDS = frozenset({
+    'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is',
+    'are', 'was', 'were', 'what', 'how', 'why', 'when', 'where', 'who', 'which', 'does',
+    'did', 'about', 'this', 'that', 'from', 'can', 'say', 'says'
+})
+
+NO_CONTEXT_ANSWER = "I couldn't find any relevant information in your documents to answer this question."
+
+
+def _source(chunk) -> str:
+    if chunk.get('page'):
+        return f"{chunk['filename']}, page {chunk['page']}"
+    return chunk['filename']
+
+
+def extractive_answer(query: str, context_chunks, max_sentences: int = 3) -> str:
+    """Answer with the context sentences that best match the query's words.
+
+    Sentences are ranked by the number of distinct query words they contain,
+    then by the rank of their chunk and their position in it. Without any
+    overlap, the opening sentence of the best chunk is quoted.
+    """
+    if not context_chunks:
+        return NO_CONTEXT_ANSWER
+    query_words = {word for word in _WORD.findall(query.lower())
+                   if len(word) > 2 and word not in STOP_WORDS}
+
+    candidates = []
+    seen = set()
+    for rank, chunk in enumerate(context_chunks):
+        for position, sentence in enumerate(_SENTENCE_END.split(chunk['text'])):
+            sentence = ' '.join(sentence.split())
+            if sentence and sentence not in seen:  # overlapping chunks repeat sentences
+                seen.add(sentence)
+                overlap = len(query_words & set(_WORD.findall(sentence.lower())))
+                candidates.append((overlap, rank, position, sentence, chunk))
+    if not candidates:
+        return NO_CONTEXT_ANSWER
+
+    best = sorted((c for c in candidates if c[0] > 0), key=lambda c: (-c[0], c[1], c[2]))[:max_sentences]
+    if not best:
+        best = [min(candidates, key=lambda c: (c[1], c[2]))]
+    # Quote in document order so the answer reads naturally
+    best.sort(key=lambda c: (c[1], c[2]))
+    lines = [f"- {sentence} [{_source(chunk)}]" for _, _, _, sentence, chunk in best]
+    return "Based on your documents:\n" + "\n".join(lines)
+
+
+class LocalLLM:
+    """Extractive answers streamed token by token with artificial latency."""
+
+    def __init__(self, latency_ms: float = 0.0, token_ms: float = 0.0, max_sentences: int = 3):
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.max_sentences = max_sentences
+
+    def stream(self, query: str, context_chunks):
+        """Yield the answer as whitespace-prefixed word tokens."""
+        answer = extractive_answer(query, context_chunks, self.max_sentences)
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+        for position, token in enumerate(_TOKEN.findall(answer)):
+            if position and self.token_ms > 0:
+                time.sleep(self.token_ms / 1000.0)
+            yield token
+
+    def generate(self, query: str, context_chunks) -> str:
+        return ''.join(self.stream(query, context_chunks))
@@ -0,0 +1,264 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Stage latencies are recorded into fixed-bucket histograms; recording costs one
+``perf_counter`` pair, a bisect and a few additions under a lock. Gauges are
+evaluated lazily when ``/metrics`` is scraped.
+
+Metrics are recorded per process. When ``METRICS_DIR`` is set (gunicorn.conf.py
+sets it), every process that records metrics writes a snapshot of its
+counters, histograms and gauges to its own JSON file there, at most once per
+``FLUSH_INTERVAL`` seconds, and a scrape sums the snapshots of all workers,
+so it reports the whole server whichever worker serves it. Snapshots of
+exited workers still count towards counters and histograms, which therefore
+never go backwards. Without ``METRICS_DIR`` a scrape reports the process
+that served it (``process_id``).
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond FAISS searches up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGES = ('embed', 'faiss_search', 'rerank', 'highlight', 'prompt_build', 'llm_call',
+          'mmr', 'extraction', 'chunking', 'dedup', 'index_write')
+
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_SECONDS', '1'))
+
+
+class Histogram:
+    """Cumulative histogram of observations, split by one label value."""
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label value -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, label_value, value):
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+            series[position] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+    def render(self, snapshot=None):
+        """Exposition lines for ``snapshot`` (default: this process's series)."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        if snapshot is None:
+            snapshot = self.snapshot()
+        for label_value, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {series[-1]:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {cumulative}')
+        return lines
+
+
+class Counter:
+    """Monotonic counters, split by one label value."""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def value(self, label_value):
+        return self._values.get(label_value, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, snapshot=None):
+        """Exposition lines for ``snapshot`` (default: this process's values)."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        if snapshot is None:
+            snapshot = self.snapshot()
+        for label_value, value in sorted(snapshot.items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+stage_latency = Histogram('askmydocs_stage_duration_seconds',
+                          'Latency of RAG pipeline stages.', 'stage')
+events = Counter('askmydocs_events_total',
+                 'Pipeline events such as cache hits and misses.', 'event')
+
+_gauges = {}  # name -> (help text, callable returning a number)
+
+# Snapshot file and flush thread of the current process (see _recorded)
+_flusher = {'pid': None, 'path': None, 'dirty': None}
+
+
+def _recorded():
+    """Schedule a snapshot write after a metric of this process changed."""
+    if METRICS_DIR is None:
+        return
+    if _flusher['pid'] != os.getpid():
+        _start_flusher()
+    _flusher['dirty'].set()
+
+
+def _start_flusher():
+    # Started lazily in each process that records metrics, so every forked
+    # worker gets its own file and thread. The random suffix keeps a new
+    # worker with a reused pid from overwriting an exited worker's totals.
+    dirty = threading.Event()
+    _flusher.update(pid=os.getpid(), dirty=dirty,
+                    path=os.path.join(METRICS_DIR, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"))
+    threading.Thread(target=_flush_loop, args=(dirty,), name='metrics-flush', daemon=True).start()
+
+
+def _flush_loop(dirty):
+    while True:
+        dirty.wait()
+        time.sleep(FLUSH_INTERVAL)  # one write for all updates of an interval
+        dirty.clear()
+        flush()
+
+
+def _gauge_values():
+    values = {}
+    for name, (_, func) in _gauges.items():
+        try:
+            values[name] = func()
+        except Exception:
+            continue
+    return values
+
+
+def flush():
+    """Write this process's snapshot to ``METRICS_DIR`` (no-op if it recorded nothing)."""
+    if METRICS_DIR is None or _flusher['pid'] != os.getpid():
+        return
+    snapshot = {'histogram': stage_latency.snapshot(), 'counter': events.snapshot(),
+                'gauges': _gauge_values()}
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(_flusher['path'] + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(_flusher['path'] + '.tmp', _flusher['path'])
+
+
+atexit.register(flush)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, but belongs to another user
+    return True
+
+
+def _merged_snapshots():
+    """Sum of the snapshots in ``METRICS_DIR``.
+
+    Counters and histograms include exited processes; gauges describe the
+    current state, so only live processes are summed.
+    """
+    histogram, counter, gauges = {}, {}, {}
+    processes = 0
+    for file_name in os.listdir(METRICS_DIR):
+        if not file_name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, file_name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for label_value, series in snapshot['histogram'].items():
+            merged = histogram.setdefault(label_value, [0] * len(series))
+            for position, value in enumerate(series):
+                merged[position] += value
+        for label_value, value in snapshot['counter'].items():
+            counter[label_value] = counter.get(label_value, 0) + value
+        if _alive(int(file_name.split('-', 1)[0])):
+            processes += 1
+            for name, value in snapshot['gauges'].items():
+                gauges[name] = gauges.get(name, 0) + value
+    return histogram, counter, gauges, processes
+
+
+def observe(stage, seconds):
+    """Record one stage latency."""
+    stage_latency.observe(stage, seconds)
+    _recorded()
+
+
+@contextmanager
+def timed(stage):
+    """Time the enclosed block as one observation of ``stage``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_latency.observe(stage, time.perf_counter() - start)
+        _recorded()
+
+
+def inc(event, amount=1):
+    """Increment an event counter."""
+    events.inc(event, amount)
+    _recorded()
+
+
+def register_gauge(name, help_text, func):
+    """Register a gauge whose value is computed by ``func`` at scrape time.
+
+    With ``METRICS_DIR`` the values of the live workers are summed.
+    """
+    _gauges[name] = (help_text, func)
+
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format."""
+    if METRICS_DIR is not None and os.path.isdir(METRICS_DIR):
+        flush()  # include this worker's latest updates
+        histogram, counter, gauges, processes = _merged_snapshots()
+        lines = stage_latency.render(histogram) + events.render(counter)
+    else:
+        lines = stage_latency.render() + events.render()
+        gauges, processes = _gauge_values(), None
+    for name, value in sorted(gauges.items()):
+        help_text = _gauges[name][0] if name in _gauges else name
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    if processes is None:
+        lines.append("# HELP process_id Operating system id of the process serving this scrape.")
+        lines.append("# TYPE process_id gauge")
+        lines.append(f"process_id {os.getpid()}")
+    else:
+        lines.append("# HELP askmydocs_metrics_processes Live worker processes whose metrics are summed.")
+        lines.append("# TYPE askmydocs_metrics_processes gauge")
+        lines.append(f"askmydocs_metrics_processes {processes}")
+    return '\n'.join(lines) + '\n'
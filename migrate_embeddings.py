@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Re-embed per-user indexes with the configured embedding model (EMBEDDING_MODEL).
+Searches keep using each user's old model until that user is migrated, so
+this can run in the background while the app is serving:
+
+    nohup python migrate_embeddings.py --pause 1 &
+
+Users who uploaded most recently are migrated first.
+"""
+import os
+import sys
+import argparse
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, index_store, embedding_model
+from models import Document
+from embedding_migration import migrate_all, needs_migration
+
+def priority_order():
+    """User ids by most recent upload, newest first."""
+    with app.app_context():
+        db.create_all()
+        rows = db.session.query(Document.user_id).group_by(Document.user_id).order_by(
+            db.func.max(Document.uploaded_at).desc()
+        ).all()
+    return [user_id for user_id, in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate user indexes to the configured embedding model")
+    parser.add_argument('--user', type=int, action='append', default=[],
+                        help="migrate this user first (repeatable)")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--pause', type=float, default=0.0,
+                        help="seconds to wait between users")
+    parser.add_argument('--dry-run', action='store_true', help="only list the users to migrate")
+    args = parser.parse_args()
+
+    print(f"🔄 Target model: {embedding_model.model_id} ({embedding_model.dimension} dimensions)")
+    if args.dry_run:
+        pending = [user_id for user_id in index_store.user_ids() if needs_migration(index_store, user_id, embedding_model)]
+        print(f"{len(pending)} user indexes to migrate:")
+        for user_id in pending:
+            model_id, dimension = index_store.read_model_tag(user_id)
+            print(f"  user {user_id}: {model_id} ({dimension})")
+        return
+
+    order = args.user + priority_order()
+    summary = migrate_all(index_store, embedding_model, priority_user_ids=order,
+                          batch_size=args.batch_size, pause_seconds=args.pause)
+    print(f"Migrated {summary['migrated']} users ({summary['chunks']} chunks), {summary['failed']} failed")
+
+if __name__ == "__main__":
+    main()
+    print("Embedding migration complete!")
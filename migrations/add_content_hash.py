@@ -0,0 +1,50 @@
+"""
+Database migration to add the content_hash field to existing documents
+Run this script to update the database schema; hashes of existing files are
+filled in (they are otherwise computed on first download)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, file_sha256
+from models import Document
+from sqlalchemy import text
+
+def migrate_database():
+    """Add content_hash column to documents table and backfill it."""
+    with app.app_context():
+        try:
+            # Check if column already exists
+            result = db.session.execute(text("PRAGMA table_info(documents)"))
+            columns = [row[1] for row in result.fetchall()]
+            
+            if 'content_hash' in columns:
+                print("✅ content_hash column already exists in documents table.")
+            else:
+                print("Adding content_hash column to documents table...")
+                db.session.execute(text("ALTER TABLE documents ADD COLUMN content_hash VARCHAR(64)"))
+                db.session.commit()
+                print("✅ Successfully added content_hash column to documents table!")
+            
+            # Backfill hashes of existing files
+            filled = 0
+            for document in Document.query.filter(Document.content_hash.is_(None)).yield_per(500):
+                file_path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
+                if os.path.exists(file_path):
+                    document.content_hash = file_sha256(file_path)
+                    filled += 1
+            db.session.commit()
+            print(f"✅ Computed content hashes for {filled} documents.")
+            
+        except Exception as e:
+            print(f"❌ Error during migration: {str(e)}")
+            db.session.rollback()
+
+if __name__ == '__main__':
+    print("="*60)
+    print("Database Migration: Add Document Content Hash")
+    print("="*60)
+    migrate_database()
+    print("="*60)
@@ -0,0 +1,53 @@
+"""
+Database migration to add secondary indexes and switch SQLite to WAL mode
+Run this script to update an existing database; new databases get the
+indexes from db.create_all()
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from sqlalchemy import text
+
+INDEXES = [
+    ("ix_users_created_at_id", "users", "created_at, id"),
+    ("ix_documents_user_uploaded", "documents", "user_id, uploaded_at, id"),
+    ("ix_documents_uploaded_at", "documents", "uploaded_at"),
+]
+
+def migrate_database():
+    """Create missing indexes, enable WAL and refresh planner statistics."""
+    with app.app_context():
+        try:
+            for name, table, columns in INDEXES:
+                existing = db.session.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"),
+                    {'name': name}
+                ).first()
+                if existing:
+                    print(f"✅ Index {name} already exists.")
+                    continue
+                print(f"Creating index {name} on {table}({columns})...")
+                db.session.execute(text(f"CREATE INDEX {name} ON {table} ({columns})"))
+            db.session.commit()
+            
+            # journal_mode is persistent; the app also sets it on every connection
+            mode = db.session.execute(text("PRAGMA journal_mode=WAL")).scalar()
+            print(f"✅ Journal mode: {mode}")
+            
+            db.session.execute(text("ANALYZE"))
+            db.session.commit()
+            print("✅ Successfully added performance indexes!")
+            
+        except Exception as e:
+            print(f"❌ Error during migration: {str(e)}")
+            db.session.rollback()
+
+if __name__ == '__main__':
+    print("="*60)
+    print("Database Migration: Performance Indexes and WAL")
+    print("="*60)
+    migrate_database()
+    print("="*60)
@@ -11,6 +11,10 @@ db = SQLAlchemy()
 class User(UserMixin, db.Model):
     """User model for authentication."""
     __tablename__ = 'users'
+    __table_args__ = (
+        # Newest-first listings and keyset pagination in the admin area
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -36,6 +40,12 @@ class User(UserMixin, db.Model):
 class Document(db.Model):
     """Document model for storing uploaded files metadata."""
     __tablename__ = 'documents'
+    __table_args__ = (
+        # Per-user listings sorted by upload time; also serves plain user_id lookups
+        db.Index('ix_documents_user_uploaded', 'user_id', 'uploaded_at', 'id'),
+        # Recent uploads across all users (admin dashboard)
+        db.Index('ix_documents_uploaded_at', 'uploaded_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -44,6 +54,30 @@ class Document(db.Model):
     file_type = db.Column(db.String(10), nullable=False)  # pdf, docx, txt
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     chunk_count = db.Column(db.Integer, default=0)  # Number of chunks created
+    content_hash = db.Column(db.String(64))  # SHA-256 of the stored file (hex), used as ETag
     
     def __repr__(self):
         return f'<Document {self.original_name}>'
+
+class Stat(db.Model):
+    """Named counter maintained incrementally for the admin dashboard."""
+    __tablename__ = 'stats'
+    
+    name = db.Column(db.String(64), primary_key=True)  # e.g. 'documents', 'documents:pdf'
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<Stat {self.name}={self.value}>'
+
+class UserStat(db.Model):
+    """Per-user document and chunk totals, maintained alongside Stat."""
+    __tablename__ = 'user_stats'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    doc_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    chunk_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    user = db.relationship('User', backref=db.backref('stats', uselist=False, cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<UserStat user={self.user_id} docs={self.doc_count}>'
@@ -0,0 +1,181 @@
+"""
+Opt-in request profiler controlled from the admin area.
+
+When enabled, a cProfile run is captured for 1-in-N requests, optionally
+restricted to one user and/or one route (Flask endpoint). Each profile is
+written as a ``.prof`` file (loadable with ``pstats`` or snakeviz) next to a
+small JSON sidecar describing the request.
+
+Settings live in ``settings.json`` in the profile folder so that every worker
+process picks up changes made from the admin page.
+"""
+import os
+import json
+import time
+import random
+import pstats
+import cProfile
+import threading
+from io import StringIO
+from datetime import datetime
+
+SETTINGS_FILE = 'settings.json'
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'sample_rate': 100,  # profile 1 in N matching requests
+    'user_id': None,     # only profile this user
+    'endpoint': '',      # only profile this Flask endpoint (e.g. 'search')
+}
+SETTINGS_REFRESH_SECONDS = 2.0
+
+
+class RequestProfiler:
+    """Decide which requests to profile and store the resulting profiles."""
+
+    def __init__(self, folder: str, max_profiles: int = 200):
+        self.folder = folder
+        self.max_profiles = max_profiles
+        self._settings = dict(DEFAULT_SETTINGS)
+        self._settings_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self):
+        """Current settings, re-read from disk at most every couple of seconds."""
+        now = time.monotonic()
+        if now - self._checked_at < SETTINGS_REFRESH_SECONDS:
+            return self._settings
+        with self._lock:
+            self._checked_at = now
+            path = os.path.join(self.folder, SETTINGS_FILE)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                self._settings, self._settings_mtime = dict(DEFAULT_SETTINGS), None
+                return self._settings
+            if mtime != self._settings_mtime:
+                try:
+                    with open(path) as f:
+                        self._settings = {**DEFAULT_SETTINGS, **json.load(f)}
+                    self._settings_mtime = mtime
+                except (OSError, ValueError):
+                    pass
+        return self._settings
+
+    def update_settings(self, enabled: bool, sample_rate: int, user_id=None, endpoint: str = ''):
+        """Persist new settings for all worker processes."""
+        os.makedirs(self.folder, exist_ok=True)
+        settings = {
+            'enabled': bool(enabled),
+            'sample_rate': max(1, int(sample_rate)),
+            'user_id': int(user_id) if user_id not in (None, '') else None,
+            'endpoint': (endpoint or '').strip(),
+        }
+        path = os.path.join(self.folder, SETTINGS_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(settings, f)
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            self._checked_at = 0.0
+        return settings
+
+    def should_profile(self, endpoint: str, get_user_id) -> bool:
+        """Whether to profile this request.
+
+        ``get_user_id`` is only called when a user filter is set, so requests
+        are not forced to load the current user just to be skipped.
+        """
+        settings = self.settings
+        if not settings['enabled']:
+            return False
+        if settings['endpoint'] and settings['endpoint'] != endpoint:
+            return False
+        if settings['user_id'] is not None and settings['user_id'] != get_user_id():
+            return False
+        return random.random() * settings['sample_rate'] < 1.0
+
+    def start(self):
+        """Start profiling the current thread; returns None if a profiler is already active."""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None
+        return profile
+
+    def stop(self, profile, endpoint: str, path: str, method: str, user_id, status: int,
+             duration: float) -> str:
+        """Stop ``profile`` and write it to disk. Returns the profile name."""
+        profile.disable()
+        os.makedirs(self.folder, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        name = f"{stamp}_{endpoint or 'unknown'}_{user_id or 'anon'}_{os.getpid()}"
+        profile.dump_stats(os.path.join(self.folder, name + '.prof'))
+        with open(os.path.join(self.folder, name + '.json'), 'w') as f:
+            json.dump({
+                'name': name,
+                'endpoint': endpoint,
+                'path': path,
+                'method': method,
+                'user_id': user_id,
+                'status': status,
+                'duration_ms': round(duration * 1000, 2),
+                'pid': os.getpid(),
+                'created_at': datetime.utcnow().isoformat() + 'Z',
+            }, f)
+        self._prune()
+        return name
+
+    def _prune(self):
+        profiles = sorted(f for f in os.listdir(self.folder) if f.endswith('.prof'))
+        for filename in profiles[:-self.max_profiles] if len(profiles) > self.max_profiles else []:
+            for ext in ('.prof', '.json'):
+                try:
+                    os.remove(os.path.join(self.folder, filename[:-5] + ext))
+                except FileNotFoundError:
+                    pass
+
+    def list_profiles(self):
+        """Stored profiles, newest first."""
+        if not os.path.isdir(self.folder):
+            return []
+        profiles = []
+        for filename in sorted(os.listdir(self.folder), reverse=True):
+            if not filename.endswith('.prof'):
+                continue
+            name = filename[:-5]
+            info = {'name': name}
+            try:
+                with open(os.path.join(self.folder, name + '.json')) as f:
+                    info.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+            profiles.append(info)
+        return profiles
+
+    def profile_path(self, name: str):
+        """Path of a stored profile, or None if the name is invalid or missing."""
+        if not name or os.path.basename(name) != name or name.startswith('.'):
+            return None
+        path = os.path.join(self.folder, name + '.prof')
+        return path if os.path.exists(path) else None
+
+    def summary(self, name: str, sort: str = 'cumulative', limit: int = 40) -> str:
+        """Text report of the top functions of a stored profile."""
+        path = self.profile_path(name)
+        if not path:
+            return ''
+        out = StringIO()
+        stats = pstats.Stats(path, stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def clear(self):
+        """Delete all stored profiles (settings are kept)."""
+        for info in self.list_profiles():
+            for ext in ('.prof', '.json'):
+                try:
+                    os.remove(os.path.join(self.folder, info['name'] + ext))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Recompute the admin dashboard statistics from the users and documents tables.
+Run periodically (e.g. from cron) or after editing the database by hand.
+"""
+import os
+import sys
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db
+import stats
+
+def reconcile_stats():
+    """Rebuild the stats and user_stats tables."""
+    with app.app_context():
+        db.create_all()
+        before = stats.read_stats()
+        counters = stats.reconcile()
+        db.session.commit()
+
+        print("Reconciled statistics:")
+        for name, value in sorted(counters.items()):
+            if name == stats.RECONCILED_AT:
+                continue
+            drift = value - before.get(name, 0)
+            note = f" (drift {drift:+d})" if drift else ""
+            print(f"  {name}: {value}{note}")
+
+if __name__ == "__main__":
+    reconcile_stats()
+    print("Statistics reconciliation complete!")
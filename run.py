@@ -3,6 +3,7 @@ Simple run script for the RAG Flask Application
 """
 import os
 import sys
+import argparse
 from dotenv import load_dotenv
 
 def check_setup():
@@ -29,8 +30,10 @@ def check_setup():
             print("Please add your Gemini API key to the .env file:")
             print("GEMINI_API_KEY=your_actual_api_key_here")
             return False
+    elif llm_provider == 'local':
+        print("[SETUP] Using the local extractive LLM provider (no API key needed)")
     else:
-        print(f"❌ Error: Unknown LLM_PROVIDER '{llm_provider}'. Use 'openai' or 'gemini'.")
+        print(f"❌ Error: Unknown LLM_PROVIDER '{llm_provider}'. Use 'openai', 'gemini' or 'local'.")
         return False
     
     # Check for required files
@@ -49,8 +52,36 @@ def create_directories():
         os.makedirs(directory, exist_ok=True)
         print(f"✅ Directory {directory}/ ready")
 
+def run_production(workers):
+    """Serve with gunicorn and several worker processes.
+
+    Index writes are serialized per user with file locks and each worker
+    reloads a user's index when another worker bumps its generation,
+    so running more than one process is safe.
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    os.environ['GUNICORN_WORKERS'] = str(workers)
+    print(f"🌐 Starting gunicorn with {workers} workers...")
+    print(f"📍 Application will be available at: http://{os.getenv('GUNICORN_BIND', '0.0.0.0:5000')}")
+    print("=" * 40)
+    os.chdir(base_dir)
+    try:
+        os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn',
+                                   '-c', os.path.join(base_dir, 'gunicorn.conf.py'), 'app:app'])
+    except OSError as e:
+        print(f"❌ Could not start gunicorn: {e}")
+        print("Please install dependencies: pip install -r requirements.txt")
+        sys.exit(1)
+
 def main():
     """Main function to run the application."""
+    parser = argparse.ArgumentParser(description="Run the RAG Flask Application")
+    parser.add_argument('--production', action='store_true',
+                        help="serve with gunicorn and multiple workers instead of the dev server")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('GUNICORN_WORKERS', '4')),
+                        help="number of worker processes in production mode")
+    args = parser.parse_args()
+
     print("🚀 Starting RAG Flask Application...")
     print("=" * 40)
     
@@ -62,6 +93,9 @@ def main():
     # Create directories
     create_directories()
     
+    if args.production:
+        run_production(args.workers)
+    
     # Import and run the app
     try:
         from app import app, db
@@ -0,0 +1,61 @@
+"""
+Per-user cache of final search results.
+
+Entries map a normalized query plus the search options to the result list,
+highlighted text included, and are stamped with the version of the user's
+index when they were computed (``UserIndexStore.version``: inode and mtime
+of the generation file). Every index write (document added or removed,
+model migration) replaces that file, so an entry is served only while the
+index it was computed from is still current; no TTL is needed. Unlike the
+generation counter, the version does not repeat when a deleted user's
+files are removed and the id is given to a new user, so entries left behind
+in other workers never match the new user's index. Stale entries are
+dropped when next looked up or evicted in LRU order.
+"""
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used in cache keys."""
+    return ' '.join(query.lower().split())
+
+
+class SearchResultCache:
+    """LRU cache of search results across users, at most ``max_entries`` in total."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (user_id, key) -> (index version, results)
+
+    def get(self, user_id: int, version, key):
+        """Cached results for ``key`` at this index version, or None."""
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None:
+                return None
+            if entry[0] != version:
+                del self._entries[(user_id, key)]
+                return None
+            self._entries.move_to_end((user_id, key))
+            results = entry[1]
+        return [dict(result) for result in results]  # callers may annotate their copy
+
+    def put(self, user_id: int, version, key, results):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(user_id, key)] = (version, [dict(result) for result in results])
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """Drop every entry of a user (e.g. when the user is deleted)."""
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._entries if cache_key[0] == user_id]:
+                del self._entries[cache_key]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,144 @@
+"""
+Incrementally maintained statistics for the admin dashboard.
+
+Counters in the ``stats`` table (and per-user totals in ``user_stats``) are
+adjusted in the same transaction as the upload, delete, registration or user
+deletion that changes them, so the dashboard reads precomputed values instead
+of scanning ``users`` and ``documents``. ``reconcile()`` recomputes everything
+from scratch to repair drift from scripts that bypass these hooks; the
+dashboard runs it when the last reconciliation is older than the configured
+interval, and ``python reconcile_stats.py`` runs it on demand (e.g. from cron).
+
+Counter names: ``users``, ``documents``, ``chunks``, ``users_with_docs``,
+``documents:<file_type>`` and ``reconciled_at`` (Unix time).
+
+None of these functions commit; callers commit with their own change.
+"""
+import time
+
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db, User, Document, Stat, UserStat
+
+RECONCILED_AT = 'reconciled_at'
+
+
+def _bump(name: str, delta: int):
+    """Atomically add ``delta`` to a counter, creating it if needed."""
+    if not delta:
+        return
+    stmt = insert(Stat).values(name=name, value=delta)
+    stmt = stmt.on_conflict_do_update(index_elements=[Stat.name],
+                                      set_={'value': Stat.value + delta})
+    db.session.execute(stmt)
+
+
+def _bump_user(user_id: int, docs: int, chunks: int) -> int:
+    """Adjust a user's totals and return the new document count."""
+    stmt = insert(UserStat).values(user_id=user_id, doc_count=docs, chunk_count=chunks)
+    stmt = stmt.on_conflict_do_update(index_elements=[UserStat.user_id], set_={
+        'doc_count': UserStat.doc_count + docs,
+        'chunk_count': UserStat.chunk_count + chunks,
+    })
+    db.session.execute(stmt)
+    return db.session.execute(
+        db.select(UserStat.doc_count).where(UserStat.user_id == user_id)
+    ).scalar() or 0
+
+
+def user_created():
+    """Record a new user."""
+    _bump('users', 1)
+
+
+def user_removed(user_id: int):
+    """Record the deletion of a user and, with it, all of their documents."""
+    per_type = db.session.query(
+        Document.file_type,
+        db.func.count(Document.id),
+        db.func.coalesce(db.func.sum(Document.chunk_count), 0)
+    ).filter(Document.user_id == user_id).group_by(Document.file_type).all()
+
+    docs = sum(count for _, count, _ in per_type)
+    for file_type, count, _ in per_type:
+        _bump(f'documents:{file_type}', -count)
+    _bump('documents', -docs)
+    _bump('chunks', -sum(chunks for _, _, chunks in per_type))
+    if docs:
+        _bump('users_with_docs', -1)
+    _bump('users', -1)
+    # The user_stats row itself goes with the user (relationship cascade)
+
+
+def document_added(user_id: int, file_type: str, chunk_count: int):
+    """Record an indexed document."""
+    _bump('documents', 1)
+    _bump(f'documents:{file_type}', 1)
+    _bump('chunks', chunk_count or 0)
+    if _bump_user(user_id, 1, chunk_count or 0) == 1:
+        _bump('users_with_docs', 1)
+
+
+def document_removed(user_id: int, file_type: str, chunk_count: int):
+    """Record a deleted document."""
+    _bump('documents', -1)
+    _bump(f'documents:{file_type}', -1)
+    _bump('chunks', -(chunk_count or 0))
+    if _bump_user(user_id, -1, -(chunk_count or 0)) == 0:
+        _bump('users_with_docs', -1)
+
+
+def read_stats() -> dict:
+    """All counters as a dict (one primary-key table read)."""
+    return {name: value for name, value in db.session.query(Stat.name, Stat.value).all()}
+
+
+def top_users(limit: int = 5):
+    """Users with the most documents, as (User, doc_count) pairs."""
+    return db.session.query(User, UserStat.doc_count).join(
+        UserStat, UserStat.user_id == User.id
+    ).filter(UserStat.doc_count > 0).order_by(UserStat.doc_count.desc()).limit(limit).all()
+
+
+def reconcile():
+    """Recompute every counter from the users and documents tables."""
+    per_type = db.session.query(
+        Document.file_type,
+        db.func.count(Document.id),
+        db.func.coalesce(db.func.sum(Document.chunk_count), 0)
+    ).group_by(Document.file_type).all()
+    per_user = db.session.query(
+        Document.user_id,
+        db.func.count(Document.id),
+        db.func.coalesce(db.func.sum(Document.chunk_count), 0)
+    ).group_by(Document.user_id).all()
+
+    counters = {
+        'users': User.query.count(),
+        'documents': sum(count for _, count, _ in per_type),
+        'chunks': sum(chunks for _, _, chunks in per_type),
+        'users_with_docs': len(per_user),
+        RECONCILED_AT: int(time.time()),
+    }
+    for file_type, count, _ in per_type:
+        counters[f'documents:{file_type}'] = count
+
+    db.session.execute(db.delete(Stat))
+    db.session.execute(db.delete(UserStat))
+    db.session.execute(insert(Stat), [{'name': name, 'value': value} for name, value in counters.items()])
+    if per_user:
+        db.session.execute(insert(UserStat), [
+            {'user_id': user_id, 'doc_count': count, 'chunk_count': chunks}
+            for user_id, count, chunks in per_user
+        ])
+    return counters
+
+
+def reconcile_if_stale(max_age_seconds: int) -> bool:
+    """Reconcile if never done or older than ``max_age_seconds``. Returns True if it ran."""
+    reconciled_at = db.session.get(Stat, RECONCILED_AT)
+    if reconciled_at is not None and time.time() - reconciled_at.value < max_age_seconds:
+        return False
+    reconcile()
+    db.session.commit()
+    return True
@@ -0,0 +1,104 @@
+"""
+Single-pass upload spooling.
+
+Werkzeug normally buffers each uploaded file in a temporary file, the upload
+route then copies it to the upload folder and reads it back to check its size
+and hash it. ``SpooledUpload`` is installed as the multipart stream factory
+instead: as the request body is parsed, each chunk is written straight to a
+temporary file inside the upload folder while its SHA-256, size, leading
+bytes and UTF-8 validity are tracked. Accepting the upload is then a rename,
+and memory use stays at one parser buffer regardless of the file size.
+"""
+import os
+import codecs
+import hashlib
+import tempfile
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+HEAD_BYTES = 8192  # enough for every magic number we check
+
+
+def sniff_file_type(head: bytes, valid_utf8: bool):
+    """Guess 'pdf', 'docx' or 'txt' from the leading bytes of a file; None if unknown."""
+    if b'%PDF-' in head[:1024]:  # the header may follow up to 1 KB of junk
+        return 'pdf'
+    if head.startswith(b'PK\x03\x04'):  # DOCX is a ZIP container
+        return 'docx'
+    if valid_utf8 and b'\x00' not in head:
+        return 'txt'
+    return None
+
+
+class SpooledUpload:
+    """Writable stream that spools one uploaded file to disk in a single pass."""
+
+    def __init__(self, folder: str, max_bytes: int):
+        os.makedirs(folder, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.head = b''
+        self._sha256 = hashlib.sha256()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._valid_utf8 = True
+        self._accepted = False
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+        self._file = os.fdopen(fd, 'w+b')
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge()
+        if len(self.head) < HEAD_BYTES:
+            self.head += data[:HEAD_BYTES - len(self.head)]
+        self._sha256.update(data)
+        if self._valid_utf8:
+            try:
+                self._utf8.decode(data)
+            except UnicodeDecodeError:
+                self._valid_utf8 = False
+        return self._file.write(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    @property
+    def valid_utf8(self) -> bool:
+        if self._valid_utf8:
+            try:
+                self._utf8.decode(b'', final=True)
+            except UnicodeDecodeError:
+                self._valid_utf8 = False
+        return self._valid_utf8
+
+    def detected_type(self):
+        """File type detected from the content ('pdf', 'docx', 'txt' or None)."""
+        return sniff_file_type(self.head, self.valid_utf8)
+
+    def accept(self, destination: str):
+        """Move the spooled file to its final path (a rename, no copy)."""
+        self._file.close()
+        os.replace(self.path, destination)
+        self.path = destination
+        self._accepted = True
+
+    def close(self):
+        """Close the stream; a file that was not accepted is deleted."""
+        if not self._file.closed:
+            self._file.close()
+        if not self._accepted:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass